@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Content-addressed store for audio analysis results (Whisper segments, beats).
+
+Entries are keyed by the sha256 of the audio bytes plus the analysis
+parameters, so the same track is only analysed once no matter which job,
+Config or upload folder it comes from.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+from typing import Any, Dict, Optional
+
+from disk_cache import DiskCache
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ANALYSIS_CACHE_DIR = os.environ.get(
+    "ANALYSIS_CACHE_DIR", os.path.join(BASE_DIR, "cache", "analysis")
+)
+ANALYSIS_CACHE_MAX_BYTES = int(os.environ.get("ANALYSIS_CACHE_MAX_MB", "256")) * 1024 * 1024
+
+_HASH_CHUNK = 1024 * 1024
+
+
+def _atomic_write_json(path: str, data: Any):
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".json", dir=folder)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class AnalysisCache(DiskCache):
+    suffix = ".json"
+
+    def __init__(self, root: str, max_bytes: int):
+        super().__init__(root, max_bytes)
+        self._digests: Dict[tuple, str] = {}
+
+    def file_digest(self, path: str) -> str:
+        st = os.stat(path)
+        memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        with self._lock:
+            if memo_key in self._digests:
+                return self._digests[memo_key]
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with self._lock:
+            self._digests[memo_key] = digest
+        return digest
+
+    def remember_digest(self, path: str, digest: str):
+        """Seed the digest of a file whose hash is already known (an upload)."""
+        st = os.stat(path)
+        with self._lock:
+            self._digests[(os.path.abspath(path), st.st_size, st.st_mtime_ns)] = digest
+
+    def make_key(self, kind: str, audio_path: str, params: Dict[str, Any]) -> str:
+        payload = json.dumps({
+            "kind": kind,
+            "audio": self.file_digest(audio_path),
+            "params": params,
+        }, sort_keys=True)
+        return f"{kind}_{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            self._count(hit=False)
+            return None
+        self._touch(path)
+        self._count(hit=True)
+        return data
+
+    def put(self, key: str, data: Any):
+        _atomic_write_json(self._path(key), data)
+        self.evict()
+
+
+ANALYSIS_CACHE = AnalysisCache(ANALYSIS_CACHE_DIR, ANALYSIS_CACHE_MAX_BYTES)
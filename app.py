@@ -2,23 +2,35 @@
 # -*- coding: utf-8 -*-
 
 import os
-import threading
-import queue
 import uuid
 import datetime
 import json
+import queue
 
 from flask import (
     Flask, render_template, request, redirect,
-    url_for, send_from_directory, flash, jsonify
+    url_for, send_file, flash, jsonify,
+    Request, Response, stream_with_context
 )
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 
 from models import (
     engine, Base, Project, Job, Media, Config,
     get_session, ensure_default_configs, ensure_job_columns
 )
 import motion_pipeline
+from analysis_cache import ANALYSIS_CACHE
+from upload_store import UPLOAD_STORE
+from render_cache import RENDER_CACHE
+import whisper_pool
+import transcribe
+from scheduler import JobScheduler
+from transcribe_batch import TranscriptionBatcher
+from job_state import JOB_STATE
+from janitor import JANITOR_INSTANCE
+import job_queue
+import listing
+import metrics
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
@@ -26,26 +38,54 @@ OUTPUT_DIR = os.path.join(BASE_DIR, "outputs")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# preview jobs: low quality, draft encoder, a short window, ahead of full renders
+PREVIEW_SECONDS = float(os.environ.get("PREVIEW_SECONDS", "15"))
+PREVIEW_PRIORITY = 10
+
+# final renders can be rewritten in place (a resumed job), so plain links are
+# cached for MEDIA_MAX_AGE and then revalidated by ETag; links carrying the
+# file's version (?v=) never change and are cached for good
+MEDIA_MAX_AGE = int(os.environ.get("MEDIA_MAX_AGE", str(7 * 24 * 3600)))
+MEDIA_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # file parts are parsed straight into the upload store, hashed on the way
+        return UPLOAD_STORE.spool()
+
+
 app = Flask(__name__)
 app.secret_key = "change-this-secret"
+app.request_class = UploadRequest
 
 Base.metadata.create_all(bind=engine)
 ensure_job_columns()
 ensure_default_configs()
 
-JOB_QUEUE: "queue.Queue[int]" = queue.Queue()
+if os.environ.get("WHISPER_PRELOAD"):
+    whisper_pool.preload(os.environ["WHISPER_PRELOAD"].split(","))
+whisper_pool.start_idle_reaper()
 
 
+# ------------- Job worker (enqueue / run) -------------
 def enqueue_job(project_id: int, audio_path: str, video_path: str,
                 title: str = "", tags: str = "", config_id: int | None = None,
-                job_type: str = "standard", wizard_data: str | None = None) -> int:
+                job_type: str = "standard", wizard_data: str | None = None,
+                whisper_model: str | None = None, priority: int = 0,
+                work_key: str | None = None, render_options: dict | None = None,
+                audio_sha256: str | None = None, video_sha256: str | None = None) -> int:
     db: Session = get_session()
     try:
+        job_uuid = str(uuid.uuid4())[:8]
         job = Job(
-            uuid=str(uuid.uuid4())[:8],
+            uuid=job_uuid,
+            work_key=work_key or job_uuid,
             project_id=project_id,
             audio_path=audio_path,
             video_path=video_path,
+            audio_sha256=audio_sha256,
+            video_sha256=video_sha256,
             status="queued",
             progress=0,
             message="در صف انتظار...",
@@ -54,109 +94,197 @@ def enqueue_job(project_id: int, audio_path: str, video_path: str,
             config_id=config_id,
             job_type=job_type,
             wizard_data=wizard_data,
+            whisper_model=whisper_model,
+            priority=priority,
+            render_options=json.dumps(render_options, ensure_ascii=False) if render_options else None,
             created_at=datetime.datetime.now(),
             updated_at=datetime.datetime.now(),
         )
         db.add(job)
         db.commit()
         db.refresh(job)
-        JOB_QUEUE.put(job.id)
+        JOB_STATE.announce(job.to_dict())
+        SCHEDULER.notify()
+        BATCHER.notify()
         return job.id
     finally:
         db.close()
 
 
-def worker_loop():
-    while True:
-        job_id = JOB_QUEUE.get()
-        db: Session = get_session()
-        try:
-            job = db.get(Job, job_id)
-            if not job:
-                JOB_QUEUE.task_done()
-                db.close()
-                continue
-
-            if job.status == "cancelled":
-                JOB_QUEUE.task_done()
-                db.close()
-                continue
+def run_job(job_id: int):
+    db: Session = get_session()
+    final = None
+    try:
+        job = db.get(Job, job_id)
+        if not job:
+            return
+
+        if job.status != "running":
+            return
+
+        JOB_STATE.begin(job.to_dict())
+        JOB_STATE.update(job_id, 5, "شروع پردازش...")
+        _remember_digests(job)
+
+        conf_dict = None
+        if job.config_id:
+            cfg = db.get(Config, job.config_id)
+            if cfg:
+                conf_dict = cfg.to_config_dict()
+        whisper_model = whisper_pool.resolve_model_name(
+            job.whisper_model, (conf_dict or {}).get("whisper_model")
+        )
+        options = job.options()
+        clip = (options["start"], options["end"]) if "end" in options else None
 
-            job.status = "running"
-            job.progress = 5
-            job.message = "شروع پردازش..."
-            job.updated_at = datetime.datetime.now()
-            db.commit()
+        def progress_cb(percent, msg):
+            # memory only; JOB_STATE flushes to the DB in batches
+            JOB_STATE.update(job_id, max(0, min(100, int(percent))), msg)
 
-            conf_dict = None
-            if job.config_id:
-                cfg = db.get(Config, job.config_id)
-                if cfg:
-                    conf_dict = cfg.to_config_dict()
-
-            def progress_cb(percent, msg):
-                j = db.get(Job, job_id)
-                if not j:
-                    return
-                if j.status == "cancelled":
-                    return
-                j.progress = max(0, min(100, int(percent)))
-                j.message = msg
-                j.updated_at = datetime.datetime.now()
-                db.commit()
+        stats = {}
+        try:
+            output_path = motion_pipeline.process_job(
+                audio_path=job.audio_path,
+                video_path=job.video_path,
+                output_dir=OUTPUT_DIR,
+                progress_callback=progress_cb,
+                quality=options.get("quality", "h"),
+                config=conf_dict,
+                whisper_model=whisper_model,
+                job_key=job.work_key or job.uuid,
+                stats=stats,
+                clip=clip,
+                encoder=options.get("encoder"),
+                stage_callback=lambda name, timing: JOB_STATE.stage(job_id, name, timing),
+                stop=lambda: JOB_STATE.cancelled(job_id),
+            )
 
-            try:
-                output_path = motion_pipeline.process_job(
-                    audio_path=job.audio_path,
-                    video_path=job.video_path,
-                    output_dir=OUTPUT_DIR,
-                    progress_callback=progress_cb,
-                    quality="h",
-                    config=conf_dict,
+            db.refresh(job)
+            if job.status != "cancelled":
+                thumbs = _load_thumbnails(stats.get("thumbnails"))
+                media = Media(
+                    project_id=job.project_id,
+                    job_id=job.id,
+                    file_path=output_path,
+                    media_type="preview" if job.job_type == "preview" else "video",
+                    poster_path=thumbs.pop("poster", None),
+                    sprite_json=json.dumps(thumbs, ensure_ascii=False) if thumbs.get("sheets") else None,
+                    created_at=datetime.datetime.now(),
                 )
+                db.add(media)
+
+                job.status = "done"
+                job.progress = 100
+                job.message = "تمام شد ✅"
+                job.output_path = output_path
+                job.stats_json = json.dumps(stats, ensure_ascii=False)
+                job.updated_at = datetime.datetime.now()
+                db.commit()
 
-                if job.status != "cancelled":
-                    media = Media(
-                        project_id=job.project_id,
-                        job_id=job.id,
-                        file_path=output_path,
-                        media_type="video",
-                        created_at=datetime.datetime.now(),
-                    )
-                    db.add(media)
-
-                    job.status = "done"
-                    job.progress = 100
-                    job.message = "تمام شد ✅"
-                    job.output_path = output_path
-                    job.updated_at = datetime.datetime.now()
-                    db.commit()
-
-            except Exception as e:
+        except Exception as e:
+            db.rollback()
+            db.refresh(job)
+            # a cancel stops the pipeline with JobCancelled (its running
+            # processes are killed); keep the cancel, not an error
+            if job.status != "cancelled":
                 job.status = "error"
                 job.progress = 0
                 job.message = "خطا در اجرای جاب"
                 job.error = str(e)
-                job.updated_at = datetime.datetime.now()
-                db.commit()
+            job.stats_json = json.dumps(stats, ensure_ascii=False) if stats else job.stats_json
+            job.updated_at = datetime.datetime.now()
+            db.commit()
+
+        final = job.to_dict()
+        metrics.JOBS_FINISHED.inc(status=final["status"], job_type=final.get("job_type") or "standard")
+
+    finally:
+        JOB_STATE.end(job_id, final)
+        db.close()
 
-        finally:
-            JOB_QUEUE.task_done()
-            db.close()
+
+def _load_thumbnails(index_path: str | None) -> dict:
+    if not index_path:
+        return {}
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def pending_transcriptions(limit: int):
+    db: Session = get_session()
+    try:
+        jobs = (
+            db.query(Job)
+            # a preview transcribes only up to the end of its window itself
+            .filter(Job.status == "queued", Job.job_type != "preview")
+            .order_by(Job.priority.desc(), Job.created_at.asc(), Job.id.asc())
+            .limit(limit)
+            .all()
+        )
+        items = []
+        for job in jobs:
+            _remember_digests(job)
+            cfg = db.get(Config, job.config_id) if job.config_id else None
+            conf_dict = cfg.to_config_dict() if cfg else {}
+            model = whisper_pool.resolve_model_name(job.whisper_model, conf_dict.get("whisper_model"))
+            options = transcribe.options_for(conf_dict.get("text") or {})
+            items.append((job.audio_path, model, options["language"], options["word_timestamps"]))
+        return items
+    finally:
+        db.close()
 
 
-worker_thread = threading.Thread(target=worker_loop, daemon=True)
-worker_thread.start()
+job_queue.recover_jobs()
+UPLOAD_STORE.sweep_spools()
+SCHEDULER = JobScheduler(run_job)
+SCHEDULER.start()
+BATCHER = TranscriptionBatcher(pending_transcriptions)
+BATCHER.start()
+JOB_STATE.start()
+JANITOR_INSTANCE.start()
 
 
-def _save_upload(file_obj, subdir: str) -> str:
+# ------------- Uploads -------------
+def _upload_subdir(project_id: int) -> str:
+    # two uploads in the same second must not share a folder
+    stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"project_{project_id}_job_{stamp}_{uuid.uuid4().hex[:6]}"
+
+
+def _save_upload(file_obj, subdir: str) -> tuple[str, str | None]:
+    """(path, sha256) of an upload, linked into the job's folder from the store."""
     if not file_obj or not file_obj.filename:
-        return ""
-    folder = os.path.join(UPLOAD_DIR, subdir)
-    os.makedirs(folder, exist_ok=True)
-    path = os.path.join(folder, file_obj.filename)
-    file_obj.save(path)
-    return path
+        return "", None
+    path = os.path.join(UPLOAD_DIR, subdir, os.path.basename(file_obj.filename))
+    path, digest = UPLOAD_STORE.save(file_obj, path)
+    ANALYSIS_CACHE.remember_digest(path, digest)
+    return path, digest
+
+
+def _remember_digests(job: Job):
+    # analysis cache keys reuse the upload hash instead of re-reading the file
+    for path, digest in ((job.audio_path, job.audio_sha256), (job.video_path, job.video_sha256)):
+        if digest and path and os.path.exists(path):
+            ANALYSIS_CACHE.remember_digest(path, digest)
+
+
+def _preview_options(form) -> dict | None:
+    if form.get("preview") != "1":
+        return None
+    try:
+        start = max(0.0, float(form.get("preview_start") or 0))
+    except ValueError:
+        start = 0.0
+    try:
+        end = float(form.get("preview_end") or 0)
+    except ValueError:
+        end = 0.0
+    if end <= start:
+        end = start + PREVIEW_SECONDS
+    return {"quality": "l", "start": start, "end": end, "encoder": "draft"}
 
 
 @app.route("/")
@@ -181,6 +309,9 @@ def configs_list():
             music_type_val = request.form.get("music_type") or None
             if music_type_val not in ("iranian", "foreign"):
                 music_type_val = None
+            whisper_model_val = request.form.get("whisper_model") or None
+            if whisper_model_val not in whisper_pool.WHISPER_MODELS:
+                whisper_model_val = None
 
             text_json_raw = request.form.get("advanced_json_text") or "{}"
             video_json_raw = request.form.get("advanced_json_video") or "{}"
@@ -205,6 +336,7 @@ def configs_list():
                 border_color=border_color,
                 font_name=font_name,
                 music_type=music_type_val,
+                whisper_model=whisper_model_val,
                 advanced_json=advanced_json,
                 created_at=datetime.datetime.now(),
             )
@@ -214,7 +346,8 @@ def configs_list():
             return redirect(url_for("configs_list"))
 
         configs = db.query(Config).order_by(Config.created_at.desc()).all()
-        return render_template("configs.html", configs=configs)
+        return render_template("configs.html", configs=configs,
+                               whisper_models=whisper_pool.WHISPER_MODELS)
     finally:
         db.close()
 
@@ -241,6 +374,10 @@ def configs_edit(config_id: int):
             if music_type_val not in ("iranian", "foreign"):
                 music_type_val = None
             cfg.music_type = music_type_val
+            whisper_model_val = request.form.get("whisper_model") or None
+            if whisper_model_val not in whisper_pool.WHISPER_MODELS:
+                whisper_model_val = None
+            cfg.whisper_model = whisper_model_val
 
             text_json_raw = request.form.get("advanced_json_text") or "{}"
             video_json_raw = request.form.get("advanced_json_video") or "{}"
@@ -267,7 +404,8 @@ def configs_edit(config_id: int):
         text_raw = json.dumps(adv.get("text", {}), ensure_ascii=False, indent=2)
         video_raw = json.dumps(adv.get("video", {}), ensure_ascii=False, indent=2)
 
-        return render_template("configs_edit.html", cfg=cfg, text_raw=text_raw, video_raw=video_raw)
+        return render_template("configs_edit.html", cfg=cfg, text_raw=text_raw, video_raw=video_raw,
+                               whisper_models=whisper_pool.WHISPER_MODELS)
     finally:
         db.close()
 
@@ -302,12 +440,9 @@ def projects_list():
             flash(f"پروژه '{project.name}' ساخته شد.", "success")
             return redirect(url_for("project_detail", project_id=project.id))
 
-        projects = db.query(Project).order_by(Project.created_at.desc()).all()
-        job_counts = {
-            p.id: db.query(Job).filter(Job.project_id == p.id).count()
-            for p in projects
-        }
-        return render_template("projects.html", projects=projects, job_counts=job_counts)
+        cursor = request.args.get("cursor")
+        rows, next_cursor = listing.project_page(db, cursor, listing.page_limit(request.args.get("limit")))
+        return render_template("projects.html", rows=rows, cursor=cursor, next_cursor=next_cursor)
     finally:
         db.close()
 
@@ -329,6 +464,7 @@ def project_detail(project_id: int):
             jobs=jobs,
             medias=medias,
             configs=configs,
+            whisper_models=whisper_pool.WHISPER_MODELS,
         )
     finally:
         db.close()
@@ -347,6 +483,10 @@ def project_new_job(project_id: int):
         job_tags = request.form.get("job_tags") or ""
         config_id_val = request.form.get("config_id")
         config_id = int(config_id_val) if config_id_val else None
+        whisper_model = request.form.get("whisper_model") or None
+        if whisper_model not in whisper_pool.WHISPER_MODELS:
+            whisper_model = None
+        preview = _preview_options(request.form)
 
         job_audio = request.files.get("job_audio")
         job_video = request.files.get("job_video")
@@ -357,18 +497,23 @@ def project_new_job(project_id: int):
             flash("فایل ویدیویی جاب را انتخاب کنید.", "error")
             return redirect(url_for("project_detail", project_id=project.id))
 
-        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        subdir = f"project_{project.id}_job_{stamp}"
-        audio_path = _save_upload(job_audio, subdir)
-        video_path = _save_upload(job_video, subdir)
+        subdir = _upload_subdir(project.id)
+        audio_path, audio_sha256 = _save_upload(job_audio, subdir)
+        video_path, video_sha256 = _save_upload(job_video, subdir)
 
         job_id = enqueue_job(
             project_id=project.id,
             audio_path=audio_path,
             video_path=video_path,
+            audio_sha256=audio_sha256,
+            video_sha256=video_sha256,
             title=job_title,
             tags=job_tags,
             config_id=config_id,
+            job_type="preview" if preview else "standard",
+            whisper_model=whisper_model,
+            priority=PREVIEW_PRIORITY if preview else 0,
+            render_options=preview,
         )
         flash(f"جاب جدید #{job_id} ساخته شد.", "success")
         return redirect(url_for("jobs_detail", job_id=job_id))
@@ -391,6 +536,7 @@ def jobs_cancel(job_id: int):
             job.message = "توسط کاربر کنسل شد."
             job.updated_at = datetime.datetime.now()
             db.commit()
+            JOB_STATE.cancel(job.to_dict())
             flash("جاب کنسل شد.", "success")
         else:
             flash("این جاب در حال اجرا یا صف نیست.", "error")
@@ -409,15 +555,25 @@ def jobs_requeue(job_id: int):
             flash("جاب پیدا نشد.", "error")
             return redirect(url_for("jobs_list"))
 
+        # a failed/cancelled job resumes from its last completed stage, but
+        # only once its run has ended: a cancelled job is still running until
+        # its worker releases the lease, and two runs must not share a workdir
+        resumable = job.status in ("error", "cancelled") and job.lease_owner is None
         new_id = enqueue_job(
             project_id=job.project_id,
             audio_path=job.audio_path,
             video_path=job.video_path,
+            audio_sha256=job.audio_sha256,
+            video_sha256=job.video_sha256,
             title=job.title,
             tags=job.tags,
             config_id=job.config_id,
             job_type=job.job_type or "standard",
             wizard_data=job.wizard_data,
+            whisper_model=job.whisper_model,
+            priority=job.priority or 0,
+            work_key=job.work_key if resumable else None,
+            render_options=job.options() or None,
         )
         flash(f"جاب جدید #{new_id} از روی این جاب ساخته شد.", "success")
         return redirect(url_for("jobs_detail", job_id=new_id))
@@ -425,6 +581,41 @@ def jobs_requeue(job_id: int):
         db.close()
 
 
+@app.route("/jobs/<int:job_id>/approve", methods=["POST"])
+def jobs_approve(job_id: int):
+    """Queue the full-quality render of an approved preview. The preview
+    only analysed its window, so this one runs Whisper and beat tracking on
+    the whole song (served from the analysis cache if it was done before)."""
+    db: Session = get_session()
+    try:
+        job = db.get(Job, job_id)
+        if not job:
+            flash("جاب پیدا نشد.", "error")
+            return redirect(url_for("jobs_list"))
+        if job.job_type != "preview" or job.status != "done":
+            flash("فقط پیش‌نمایش تمام‌شده را می‌توان تأیید کرد.", "error")
+            return redirect(url_for("jobs_detail", job_id=job_id))
+
+        new_id = enqueue_job(
+            project_id=job.project_id,
+            audio_path=job.audio_path,
+            video_path=job.video_path,
+            audio_sha256=job.audio_sha256,
+            video_sha256=job.video_sha256,
+            title=job.title,
+            tags=job.tags,
+            config_id=job.config_id,
+            job_type="standard",
+            wizard_data=job.wizard_data,
+            whisper_model=job.whisper_model,
+            render_options={"from_preview": job.id},
+        )
+        flash(f"رندر کامل #{new_id} از روی این پیش‌نمایش در صف قرار گرفت.", "success")
+        return redirect(url_for("jobs_detail", job_id=new_id))
+    finally:
+        db.close()
+
+
 # ------------- Create new Job globally -------------
 @app.route("/jobs/new", methods=["GET", "POST"])
 def jobs_new():
@@ -439,6 +630,10 @@ def jobs_new():
             job_tags = request.form.get("job_tags") or ""
             config_id_val = request.form.get("config_id")
             config_id = int(config_id_val) if config_id_val else None
+            whisper_model = request.form.get("whisper_model") or None
+            if whisper_model not in whisper_pool.WHISPER_MODELS:
+                whisper_model = None
+            preview = _preview_options(request.form)
             overlay_text = request.form.get("overlay_text") or ""
             text_color = request.form.get("text_color") or "#ffffff"
             accent_color = request.form.get("accent_color") or "#ec4899"
@@ -485,10 +680,9 @@ def jobs_new():
                 db.refresh(project)
                 new_project = True
 
-            stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            subdir = f"project_{project.id}_job_{stamp}"
-            audio_path = _save_upload(job_audio, subdir)
-            video_path = _save_upload(job_video, subdir)
+            subdir = _upload_subdir(project.id)
+            audio_path, audio_sha256 = _save_upload(job_audio, subdir)
+            video_path, video_sha256 = _save_upload(job_video, subdir)
 
             wizard_payload = json.dumps({
                 "overlay_text": overlay_text,
@@ -510,11 +704,16 @@ def jobs_new():
                 project_id=project.id,
                 audio_path=audio_path,
                 video_path=video_path,
+                audio_sha256=audio_sha256,
+                video_sha256=video_sha256,
                 title=job_title,
                 tags=job_tags,
                 config_id=config_id,
-                job_type="standard",
+                job_type="preview" if preview else "standard",
                 wizard_data=wizard_payload,
+                whisper_model=whisper_model,
+                priority=PREVIEW_PRIORITY if preview else 0,
+                render_options=preview,
             )
 
             if new_project:
@@ -523,7 +722,8 @@ def jobs_new():
                 flash(f"جاب #{job_id} برای پروژه '{project.name}' ساخته شد.", "success")
             return redirect(url_for("jobs_detail", job_id=job_id))
 
-        return render_template("jobs_new.html", configs=configs, projects=projects)
+        return render_template("jobs_new.html", configs=configs, projects=projects,
+                               whisper_models=whisper_pool.WHISPER_MODELS)
     finally:
         db.close()
 
@@ -533,17 +733,52 @@ def jobs_new():
 def jobs_list():
     db: Session = get_session()
     try:
-        projects = db.query(Project).order_by(Project.created_at.desc()).all()
-        proj_jobs = []
-        for p in projects:
-            jobs = db.query(Job).filter(Job.project_id == p.id).order_by(Job.created_at.desc()).all()
-            if jobs:
-                proj_jobs.append((p, jobs))
-        return render_template("jobs.html", proj_jobs=proj_jobs)
+        cursor = request.args.get("cursor")
+        rows, next_cursor = listing.project_page(
+            db, cursor, listing.page_limit(request.args.get("limit"), listing.GROUP_PAGE_SIZE), with_jobs=True
+        )
+        jobs = listing.latest_jobs(db, [p.id for p, _ in rows])
+        posters = listing.job_posters(db, [j.id for p_jobs in jobs.values() for j in p_jobs])
+        proj_jobs = [(p, jobs[p.id], count) for p, count in rows]
+        return render_template("jobs.html", proj_jobs=proj_jobs, posters=posters, cursor=cursor,
+                               next_cursor=next_cursor, per_project=listing.JOBS_PER_PROJECT)
+    finally:
+        db.close()
+
+
+# ------------- JSON lists (dashboard) -------------
+@app.route("/api/projects")
+def api_projects():
+    db: Session = get_session()
+    try:
+        rows, next_cursor = listing.project_page(
+            db, request.args.get("cursor"), listing.page_limit(request.args.get("limit"))
+        )
+        return jsonify({
+            "items": [{**p.to_dict(), "job_count": count} for p, count in rows],
+            "next_cursor": next_cursor,
+        })
+    finally:
+        db.close()
+
+
+@app.route("/api/jobs")
+def api_jobs():
+    db: Session = get_session()
+    try:
+        jobs, next_cursor = listing.job_page(
+            db,
+            request.args.get("cursor"),
+            listing.page_limit(request.args.get("limit")),
+            project_id=request.args.get("project_id", type=int),
+            status=request.args.get("status") or None,
+        )
+        return jsonify({"items": [j.to_dict() for j in jobs], "next_cursor": next_cursor})
     finally:
         db.close()
 
 
+# ------------- Job detail / status -------------
 @app.route("/jobs/<int:job_id>")
 def jobs_detail(job_id: int):
     db: Session = get_session()
@@ -562,16 +797,151 @@ def jobs_detail(job_id: int):
         db.close()
 
 
+def _load_job_dict(job_id: int):
+    db: Session = get_session()
+    try:
+        job = db.get(Job, job_id)
+        return job.to_dict() if job else None
+    finally:
+        db.close()
+
+
 @app.route("/jobs/<int:job_id>/json")
 def jobs_status_json(job_id: int):
+    data = JOB_STATE.get(job_id, _load_job_dict)
+    if data is None:
+        return jsonify({"error": "not found"}), 404
+    return jsonify(data)
+
+
+# ------------- Live job events (SSE) -------------
+SSE_KEEPALIVE_SECONDS = 15
+FINAL_STATUSES = ("done", "error", "cancelled")
+
+
+def _sse(kind: str, data) -> str:
+    return f"event: {kind}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+def _event_stream(q: queue.Queue, initial: list, until_final: int | None = None):
+    """Server-Sent Events from a JOB_STATE subscription; with until_final the
+    stream ends once that job reaches a final status."""
+    try:
+        for job in initial:
+            yield _sse("status", job)
+            if until_final is not None and job.get("status") in FINAL_STATUSES:
+                return
+        while True:
+            try:
+                event = q.get(timeout=SSE_KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            yield _sse(event["type"], event["data"])
+            if (until_final is not None and event["type"] == "status"
+                    and event["data"].get("status") in FINAL_STATUSES):
+                return
+    finally:
+        JOB_STATE.unsubscribe(q)
+
+
+def _sse_response(stream) -> Response:
+    return Response(
+        stream_with_context(stream),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/jobs/<int:job_id>/events")
+def jobs_events(job_id: int):
+    # subscribe first so nothing between the snapshot and the stream is lost
+    q = JOB_STATE.subscribe(job_id=job_id)
+    data = JOB_STATE.get(job_id, _load_job_dict)
+    if data is None:
+        JOB_STATE.unsubscribe(q)
+        return jsonify({"error": "not found"}), 404
+    return _sse_response(_event_stream(q, [data], until_final=job_id))
+
+
+@app.route("/projects/<int:project_id>/events")
+def project_events(project_id: int):
+    q = JOB_STATE.subscribe(project_id=project_id)
     db: Session = get_session()
     try:
-        job = db.get(Job, job_id)
-        if not job:
-            return jsonify({"error": "not found"}), 404
-        return jsonify(job.to_dict())
+        jobs = (
+            db.query(Job.id)
+            .filter(Job.project_id == project_id, Job.status.in_(("queued", "running")))
+            .all()
+        )
     finally:
         db.close()
+    initial = [d for d in (JOB_STATE.get(job_id, _load_job_dict) for (job_id,) in jobs) if d]
+    return _sse_response(_event_stream(q, initial))
+
+
+# ------------- Stats / metrics -------------
+@app.route("/cache/stats")
+def cache_stats():
+    return jsonify({
+        "analysis": ANALYSIS_CACHE.stats(),
+        "segments": RENDER_CACHE.stats(),
+        "uploads": UPLOAD_STORE.stats(),
+    })
+
+
+@app.route("/storage/report")
+def storage_report():
+    return jsonify(JANITOR_INSTANCE.report())
+
+
+@app.route("/scheduler/stats")
+def scheduler_stats():
+    return jsonify({**SCHEDULER.stats(), "transcription": BATCHER.stats(), "job_state": JOB_STATE.stats()})
+
+
+@metrics.REGISTRY.collector
+def _service_metrics():
+    scheduler = SCHEDULER.stats()
+    zero = {"queued": 0, "oldest_seconds": 0.0}
+    depth = {"standard": zero, "preview": zero, **job_queue.queue_depth()}
+    caches = {"analysis": ANALYSIS_CACHE.counters(), "segments": RENDER_CACHE.counters()}
+    job_state = JOB_STATE.stats()
+    batcher = BATCHER.stats()
+    return [
+        ("jobs_queued", "gauge", "Jobs waiting in the queue.",
+         [({"job_type": t}, d["queued"]) for t, d in depth.items()]),
+        ("jobs_queued_oldest_seconds", "gauge", "Age of the oldest queued job.",
+         [({"job_type": t}, d["oldest_seconds"]) for t, d in depth.items()]),
+        ("jobs_running", "gauge", "Jobs being run by this process.", [({}, scheduler["running"])]),
+        ("workers", "gauge", "Job worker threads.", [({}, scheduler["workers"])]),
+        ("slot_active", "gauge", "Holders of each stage concurrency slot.",
+         [({"slot": name}, s["active"]) for name, s in scheduler["stages"].items()]),
+        ("slot_limit", "gauge", "Size of each stage concurrency slot.",
+         [({"slot": name}, s["limit"]) for name, s in scheduler["stages"].items() if s["limit"]]),
+        ("cache_hits_total", "counter", "Lookups served from a disk cache.",
+         [({"cache": name}, c["hits"]) for name, c in caches.items()]),
+        ("cache_misses_total", "counter", "Lookups a disk cache could not serve.",
+         [({"cache": name}, c["misses"]) for name, c in caches.items()]),
+        ("cache_hit_ratio", "gauge", "Hits over lookups of a disk cache since start.",
+         [({"cache": name}, c["hit_ratio"]) for name, c in caches.items()]),
+        ("cache_evictions_total", "counter", "Entries evicted from a disk cache.",
+         [({"cache": name}, c["evictions"]) for name, c in caches.items()]),
+        ("uploads_total", "counter", "Files saved to the upload store.", [({}, UPLOAD_STORE.uploads)]),
+        ("uploads_deduplicated_total", "counter", "Uploads that were already in the store.",
+         [({}, UPLOAD_STORE.deduplicated)]),
+        ("whisper_models_loaded", "gauge", "Whisper models held in memory.",
+         [({}, len(whisper_pool.loaded_models()))]),
+        ("transcription_batches_total", "counter", "Background transcription batches.",
+         [({}, batcher["batches"])]),
+        ("job_state_flushes_total", "counter", "Batched progress writes to the database.",
+         [({}, job_state["flushes"])]),
+    ]
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
 
 
 # ------------- Media -------------
@@ -579,7 +949,7 @@ def jobs_status_json(job_id: int):
 def media_list():
     db: Session = get_session()
     try:
-        medias = db.query(Media).order_by(Media.created_at.desc()).all()
+        medias = db.query(Media).options(joinedload(Media.project)).order_by(Media.created_at.desc()).all()
         return render_template("media.html", medias=medias)
     finally:
         db.close()
@@ -593,12 +963,87 @@ def media_file(media_id: int):
         if not media:
             flash("مدیا پیدا نشد.", "error")
             return redirect(url_for("media_list"))
-        directory = os.path.dirname(media.file_path)
-        fname = os.path.basename(media.file_path)
-        return send_from_directory(directory, fname, as_attachment=False)
+        if not os.path.exists(media.file_path):
+            flash("فایل این مدیا روی دیسک نیست.", "error")
+            return redirect(url_for("media_list"))
+        return _send_cached(media.file_path)
+    finally:
+        db.close()
+
+
+@app.route("/media/<int:media_id>/poster")
+def media_poster(media_id: int):
+    db: Session = get_session()
+    try:
+        media = db.get(Media, media_id)
+        if not media or not media.poster_path or not os.path.exists(media.poster_path):
+            return "", 404
+        return _send_cached(media.poster_path)
     finally:
         db.close()
 
 
+@app.route("/media/<int:media_id>/sprite/<int:sheet>")
+def media_sprite(media_id: int, sheet: int):
+    db: Session = get_session()
+    try:
+        media = db.get(Media, media_id)
+        sheets = media.sprite().get("sheets", []) if media else []
+        if sheet >= len(sheets) or not os.path.exists(sheets[sheet]):
+            return "", 404
+        return _send_cached(sheets[sheet])
+    finally:
+        db.close()
+
+
+def _send_cached(path: str):
+    versioned = request.args.get("v") == _media_version(path)
+    # conditional=True: Range / If-Range, If-None-Match and If-Modified-Since
+    resp = send_file(
+        path,
+        conditional=True,
+        etag=True,
+        max_age=MEDIA_IMMUTABLE_MAX_AGE if versioned else MEDIA_MAX_AGE,
+    )
+    resp.cache_control.public = True
+    if versioned:
+        resp.cache_control.immutable = True
+    return resp
+
+
+def _media_version(path: str) -> str | None:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return f"{st.st_mtime_ns:x}{st.st_size:x}"
+
+
+@app.template_global()
+def media_url(media: Media) -> str:
+    return url_for("media_file", media_id=media.id, v=_media_version(media.file_path))
+
+
+@app.template_global()
+def poster_url(media: Media) -> str | None:
+    if not media.poster_path:
+        return None
+    return url_for("media_poster", media_id=media.id, v=_media_version(media.poster_path))
+
+
+@app.template_global()
+def sprite_data(media: Media) -> dict:
+    """What the scrub preview of a poster needs, with sheet paths as URLs."""
+    sprite = media.sprite()
+    sheets = sprite.get("sheets") or []
+    return {
+        **sprite,
+        "sheets": [
+            url_for("media_sprite", media_id=media.id, sheet=i, v=_media_version(path))
+            for i, path in enumerate(sheets)
+        ],
+    }
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True, use_reloader=False)
\ No newline at end of file
@@ -1,32 +1,154 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+"""
+Beat tracking on a streamed, downsampled decode of the track.
+
+ffmpeg decodes straight to mono float32 at ANALYSIS_SR and the onset
+envelope is built block by block, so only one block of samples (plus the
+small envelope itself) is ever held in memory, whatever the track length.
+"""
 
 import os
 import json
-from typing import Tuple, List
+import shutil
+import subprocess
+from typing import Iterator, Tuple, List, Optional
+
+from analysis_cache import ANALYSIS_CACHE
+import metrics
 
 try:
+    import numpy as np
     import librosa
 except Exception:
+    np = None
     librosa = None
 
+ANALYSIS_SR = int(os.environ.get("BEATS_SR", "11025"))
+# same 23 ms hop / 93 ms window as librosa's defaults at 22050 Hz
+HOP_LENGTH = max(1, int(round(512 * ANALYSIS_SR / 22050)))
+N_FFT = 4 * HOP_LENGTH
+BLOCK_SECONDS = 30
+
+
+def _decode_blocks(audio_path: str, sr: int, block_samples: int,
+                   window: Optional[Tuple[float, float]] = None) -> Iterator["np.ndarray"]:
+    if shutil.which("ffmpeg") is None:
+        if window:
+            y, _ = librosa.load(audio_path, sr=sr, mono=True,
+                                offset=window[0], duration=window[1] - window[0])
+        else:
+            y, _ = librosa.load(audio_path, sr=sr, mono=True)
+        for i in range(0, len(y), block_samples):
+            yield y[i:i + block_samples]
+        return
+
+    seek = ["-ss", f"{window[0]:.3f}", "-t", f"{window[1] - window[0]:.3f}"] if window else []
+    cmd = [
+        "ffmpeg", "-nostdin", "-loglevel", "error",
+        *seek, "-i", audio_path,
+        "-ac", "1", "-ar", str(sr),
+        "-f", "f32le", "-",
+    ]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    try:
+        while True:
+            raw = proc.stdout.read(block_samples * 4)
+            if not raw:
+                break
+            yield np.frombuffer(raw[:len(raw) // 4 * 4], dtype=np.float32)
+    except BaseException:
+        # the consumer stopped early (GeneratorExit) or failed: ffmpeg is
+        # not needed any more
+        proc.stdout.close()
+        proc.kill()
+        proc.wait()
+        raise
+    # at EOF ffmpeg may still be shutting down; wait for its real exit code
+    proc.stdout.close()
+    if metrics.wait(proc, "ffmpeg_decode") != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+
+def onset_envelope(blocks, sr: int = ANALYSIS_SR):
+    """librosa.onset.onset_strength computed block by block: log-mel
+    spectral flux, carrying the STFT overlap and the last mel frame across
+    block boundaries. Frames line up with onset_strength(center=True).
 
-def analyze_beats(audio_path: str, cache_dir: str) -> Tuple[str, List[float]]:
+    One difference: onset_strength clamps the log-mel at 80 dB under the
+    loudest bin of the whole track (power_to_db's top_db=80), which a block
+    cannot know, so here the log-mel is not clamped (top_db=None). Only
+    near-silent stretches can get a (slightly) different envelope."""
+    mel_basis = librosa.filters.mel(sr=sr, n_fft=N_FFT)
+    carry = np.zeros(0, dtype=np.float32)
+    prev = None
+    parts = []
+    for block in blocks:
+        y = np.concatenate([carry, block])
+        n_frames = 1 + (len(y) - N_FFT) // HOP_LENGTH if len(y) >= N_FFT else 0
+        if n_frames <= 0:
+            carry = y
+            continue
+        S = np.abs(librosa.stft(
+            y[:(n_frames - 1) * HOP_LENGTH + N_FFT],
+            n_fft=N_FFT, hop_length=HOP_LENGTH, center=False,
+        )) ** 2
+        mel = librosa.power_to_db(mel_basis @ S, top_db=None)
+        if prev is not None:
+            mel = np.hstack([prev, mel])
+        parts.append(np.maximum(0.0, mel[:, 1:] - mel[:, :-1]).mean(axis=0))
+        prev = mel[:, -1:]
+        carry = y[n_frames * HOP_LENGTH:]
+
+    env = np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+    return np.pad(env, (1 + N_FFT // (2 * HOP_LENGTH), 0))
+
+
+def track_beats(audio_path: str, window: Optional[Tuple[float, float]] = None) -> List[float]:
+    """Beat times in seconds of the song; with `window` only that stretch
+    is decoded and tracked."""
+    blocks = _decode_blocks(audio_path, ANALYSIS_SR, BLOCK_SECONDS * ANALYSIS_SR, window)
+    env = onset_envelope(blocks, ANALYSIS_SR)
+    if not env.any():
+        return []
+    _, beat_frames = librosa.beat.beat_track(
+        onset_envelope=env, sr=ANALYSIS_SR, hop_length=HOP_LENGTH,
+    )
+    offset = window[0] if window else 0.0
+    times = librosa.frames_to_time(beat_frames, sr=ANALYSIS_SR, hop_length=HOP_LENGTH)
+    return [offset + float(t) for t in times]
+
+
+@metrics.timed
+def analyze_beats(audio_path: str, cache_dir: str,
+                  window: Optional[Tuple[float, float]] = None) -> Tuple[str, List[float]]:
+    """Beat times of the song. A preview passes its `window`: the beats of
+    the whole song are used when already cached, otherwise only the window
+    is tracked (and not cached, the full render tracks the whole song).
+    beats_<name>.json is written for inspection and never read back."""
     os.makedirs(cache_dir, exist_ok=True)
     base = os.path.splitext(os.path.basename(audio_path))[0]
     out_json = os.path.join(cache_dir, f"beats_{base}.json")
 
-    if os.path.exists(out_json):
-        with open(out_json, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return out_json, data.get("beats", [])
-
     if librosa is None:
         beats: List[float] = []
     else:
-        y, sr = librosa.load(audio_path, sr=None, mono=True)
-        tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sr)
-        beats = (beat_frames / float(sr)).tolist()
+        cache_key = ANALYSIS_CACHE.make_key("beats", audio_path, {
+            "method": "onset_stream",
+            "sr": ANALYSIS_SR,
+            "hop": HOP_LENGTH,
+            "librosa": librosa.__version__,
+        })
+        cached = ANALYSIS_CACHE.get(cache_key)
+        if cached is not None:
+            beats = cached["beats"]
+            if window:
+                beats = [b for b in beats if window[0] <= b < window[1]]
+        elif window:
+            beats = track_beats(audio_path, window)
+        else:
+            beats = track_beats(audio_path)
+            ANALYSIS_CACHE.put(cache_key, {"beats": beats})
 
     with open(out_json, "w", encoding="utf-8") as f:
         json.dump({"beats": beats}, f, ensure_ascii=False, indent=2)
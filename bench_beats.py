@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compare the streaming beat tracker (beat_analysis.track_beats) with the old
+full-decode path: librosa.load(sr=None) + beat_track on the whole signal.
+
+    python bench_beats.py [AUDIO ...]
+
+Without arguments the tracks referenced by workdir/job_*/meta.json are used.
+Reports wall time, peak Python-side memory (tracemalloc), beat count and the
+F-measure of the new beats against the old ones (±70 ms, as in mir_eval).
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import tracemalloc
+
+import librosa
+import numpy as np
+
+import beat_analysis
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TOLERANCE = 0.07
+
+
+def full_decode_beats(audio_path):
+    y, sr = librosa.load(audio_path, sr=None, mono=True)
+    _, beat_frames = librosa.beat.beat_track(y=y, sr=sr)
+    return librosa.frames_to_time(beat_frames, sr=sr).tolist()
+
+
+def f_measure(reference, estimated, tolerance=TOLERANCE):
+    if not reference or not estimated:
+        return 0.0
+    ref = np.asarray(reference)
+    used = np.zeros(len(ref), dtype=bool)
+    hits = 0
+    for t in estimated:
+        dist = np.abs(ref - t)
+        dist[used] = np.inf
+        i = int(np.argmin(dist))
+        if dist[i] <= tolerance:
+            used[i] = True
+            hits += 1
+    precision = hits / len(estimated)
+    recall = hits / len(reference)
+    return 0.0 if hits == 0 else 2 * precision * recall / (precision + recall)
+
+
+def measure(fn, audio_path):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    beats = fn(audio_path)
+    seconds = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return beats, seconds, peak / (1024 * 1024)
+
+
+def sample_tracks():
+    tracks = []
+    for meta_path in sorted(glob.glob(os.path.join(BASE_DIR, "workdir", "job_*", "meta.json"))):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            audio = json.load(f).get("audio_path")
+        if audio and audio not in tracks:
+            tracks.append(audio)
+    return tracks
+
+
+def main(paths):
+    paths = paths or sample_tracks()
+    if not paths:
+        print("no audio given and no workdir/job_*/meta.json found")
+        return 1
+
+    for path in paths:
+        if not os.path.exists(path):
+            print(f"skip (missing): {path}")
+            continue
+        old, old_s, old_mb = measure(full_decode_beats, path)
+        new, new_s, new_mb = measure(beat_analysis.track_beats, path)
+        print(os.path.basename(path))
+        print(f"  full decode : {old_s:7.2f} s  peak {old_mb:7.1f} MB  {len(old)} beats")
+        print(f"  streaming   : {new_s:7.2f} s  peak {new_mb:7.1f} MB  {len(new)} beats"
+              f"  (sr={beat_analysis.ANALYSIS_SR}, hop={beat_analysis.HOP_LENGTH})")
+        print(f"  F-measure   : {f_measure(old, new):.3f}  speedup {old_s / max(new_s, 1e-9):.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
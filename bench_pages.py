@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Page latency of the project and job lists on a synthetic database.
+
+    python bench_pages.py [--projects 10000] [--jobs 100000] [--legacy]
+
+Builds a throwaway SQLite file (APP_DB_PATH) with the given number of
+projects and jobs, then times the first, a middle and the last page of
+each list through listing.py, walking there with the keyset cursors.
+--legacy also times the old per-project queries of the first page.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import datetime
+import tempfile
+import statistics
+
+REPEAT = 5
+
+
+def build(n_projects: int, n_jobs: int):
+    from sqlalchemy import insert
+    from models import engine, Base, Project, Job, ensure_job_columns
+
+    Base.metadata.create_all(bind=engine)
+    ensure_job_columns()
+    t0 = datetime.datetime(2024, 1, 1)
+    rng = random.Random(0)
+    with engine.begin() as conn:
+        conn.execute(insert(Project), [
+            {"id": i, "name": f"project {i}", "description": "", "created_at": t0 + datetime.timedelta(minutes=i)}
+            for i in range(1, n_projects + 1)
+        ])
+        conn.execute(insert(Job), [
+            {
+                "uuid": f"{i:08x}",
+                "project_id": rng.randint(1, n_projects),
+                "audio_path": "a.mp3",
+                "video_path": "v.mp4",
+                "status": rng.choice(("done", "done", "done", "error", "cancelled")),
+                "progress": 100,
+                "message": "",
+                "created_at": t0 + datetime.timedelta(seconds=37 * i),
+                "updated_at": t0,
+            }
+            for i in range(1, n_jobs + 1)
+        ])
+        conn.exec_driver_sql("ANALYZE")
+
+
+def timed(fn):
+    runs = []
+    for _ in range(REPEAT):
+        t0 = time.perf_counter()
+        fn()
+        runs.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(runs)
+
+
+def page_cursors(fetch):
+    """Cursors of the first, middle and last page."""
+    cursors = [None]
+    while True:
+        _, next_cursor = fetch(cursors[-1])
+        if next_cursor is None:
+            break
+        cursors.append(next_cursor)
+    return {"first": cursors[0], "middle": cursors[len(cursors) // 2], "last": cursors[-1]}, len(cursors)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--projects", type=int, default=10000)
+    parser.add_argument("--jobs", type=int, default=100000)
+    parser.add_argument("--legacy", action="store_true")
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix="bench_pages_")
+    os.environ["APP_DB_PATH"] = os.path.join(tmp, "bench.db")
+
+    import listing
+    from models import get_session, Project, Job
+
+    t0 = time.perf_counter()
+    build(args.projects, args.jobs)
+    print(f"built {args.projects} projects / {args.jobs} jobs in {time.perf_counter() - t0:.1f} s")
+
+    db = get_session()
+    try:
+        def projects(cursor):
+            return listing.project_page(db, cursor)
+
+        def jobs(cursor):
+            rows, next_cursor = listing.project_page(db, cursor, listing.GROUP_PAGE_SIZE, with_jobs=True)
+            jobs_of = listing.latest_jobs(db, [p.id for p, _ in rows])
+            listing.job_posters(db, [j.id for p_jobs in jobs_of.values() for j in p_jobs])
+            return rows, next_cursor
+
+        def api_jobs(cursor):
+            return listing.job_page(db, cursor)
+
+        for name, fetch in (("projects", projects), ("jobs", jobs), ("api/jobs", api_jobs)):
+            cursors, pages = page_cursors(fetch)
+            cells = "  ".join(
+                f"{where} {timed(lambda: fetch(cursor)):7.2f} ms" for where, cursor in cursors.items()
+            )
+            print(f"{name:9s} ({pages:5d} pages)  {cells}")
+
+        if args.legacy:
+            def legacy_projects():
+                for p in db.query(Project).order_by(Project.created_at.desc()).all():
+                    db.query(Job).filter(Job.project_id == p.id).count()
+
+            t0 = time.perf_counter()
+            legacy_projects()
+            print(f"legacy projects page: {(time.perf_counter() - t0) * 1000:9.1f} ms")
+    finally:
+        db.close()
+    print(f"database left at {os.environ['APP_DB_PATH']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
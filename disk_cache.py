@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Size-bounded on-disk cache directory with LRU eviction and hit/miss stats.
+
+Entries live at <root>/<digest[:2]>/<key><suffix>; an entry's mtime is
+bumped on every hit so eviction removes the least recently used first.
+"""
+
+import os
+import threading
+from typing import Any, Dict, List, Tuple
+
+
+class DiskCache:
+    suffix = ""
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        digest = key.rsplit("_", 1)[-1]
+        return os.path.join(self.root, digest[:2], f"{key}{self.suffix}")
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _touch(self, path: str):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for root, _, files in os.walk(self.root):
+            for fn in files:
+                if fn.startswith(".tmp_") or not fn.endswith(self.suffix):
+                    continue
+                path = os.path.join(root, fn)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def counters(self) -> Dict[str, Any]:
+        """Lookup and eviction counts, without walking the directory."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+    def stats(self) -> Dict[str, Any]:
+        entries = self._entries()
+        return {
+            **self.counters(),
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+        }
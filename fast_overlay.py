@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fast overlay renderer: draws the FarsiKinetic look without Manim.
+
+Each lyric line is shaped and rasterised once with Pillow (libraqm when
+available, otherwise arabic_reshaper + python-bidi), its pulse frames are
+pre-scaled, and every video frame is composed with NumPy and streamed to
+ffmpeg as raw RGBA. Select it per Config with "renderer": "fast" in the
+text JSON. Output is a transparent .mov, same as run_manim, so the rest of
+the pipeline does not care which renderer made it.
+"""
+
+import os
+import sys
+import json
+import math
+import shutil
+import subprocess
+from typing import Any, Dict, List, Tuple
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+try:
+    from PIL import Image, ImageDraw, ImageFont, features
+except Exception:
+    Image = None
+
+try:
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+except Exception:
+    arabic_reshaper = None
+
+from timeline import plan_timeline, pulse_phase, pulse_span, frame_count, FADE_IN, FADE_OUT
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FONTS_DIR = os.path.join(BASE_DIR, "static", "fonts")
+
+# Manim quality flag -> (width, height, fps)
+QUALITIES = {
+    "l": (854, 480, 15),
+    "m": (1280, 720, 30),
+    "h": (1920, 1080, 60),
+    "p": (2560, 1440, 60),
+    "k": (3840, 2160, 60),
+}
+FRAME_HEIGHT_UNITS = 8.0
+# Manim sizes Text at 48pt with 1/960 frame width per point (~0.71 units/em)
+EM_UNITS = 48 / 960 * (FRAME_HEIGHT_UNITS * 16 / 9)
+STROKE_UNITS_PER_WIDTH = 0.01
+SLANT_SHEAR = 0.2
+PULSE_SCALE = 1.04
+PULSE_LEVELS = 4
+
+
+def available() -> bool:
+    return np is not None and Image is not None and shutil.which("ffmpeg") is not None
+
+
+def _smooth(t: float, inflection: float = 10.0) -> float:
+    # manim.utils.rate_functions.smooth
+    def sigmoid(x):
+        return 1.0 / (1.0 + math.exp(-x))
+    error = sigmoid(-inflection / 2)
+    value = (sigmoid(inflection * (t - 0.5)) - error) / (1 - 2 * error)
+    return min(max(value, 0.0), 1.0)
+
+
+def _there_and_back(t: float) -> float:
+    return _smooth(2 * t) if t < 0.5 else _smooth(2 - 2 * t)
+
+
+def _hex_rgb(color: str) -> Tuple[int, int, int]:
+    color = (color or "#ffffff").lstrip("#")
+    if len(color) == 3:
+        color = "".join(c * 2 for c in color)
+    return int(color[0:2], 16), int(color[2:4], 16), int(color[4:6], 16)
+
+
+def _find_font(font_name: str) -> str | None:
+    for fn in os.listdir(FONTS_DIR) if os.path.isdir(FONTS_DIR) else []:
+        stem, ext = os.path.splitext(fn)
+        if stem.lower() == (font_name or "").lower() and ext.lower() in (".ttf", ".otf"):
+            return os.path.join(FONTS_DIR, fn)
+    if shutil.which("fc-match"):
+        res = subprocess.run(["fc-match", "-f", "%{file}", font_name or "sans"],
+                             capture_output=True, text=True)
+        if res.returncode == 0 and res.stdout and os.path.exists(res.stdout):
+            return res.stdout
+    return None
+
+
+def _load_font(font_name: str, size_px: int):
+    path = _find_font(font_name)
+    if path is None:
+        return ImageFont.load_default()
+    if features.check("raqm"):
+        return ImageFont.truetype(path, size_px, layout_engine=ImageFont.Layout.RAQM)
+    return ImageFont.truetype(path, size_px)
+
+
+def _shape(text: str, font) -> Tuple[str, Dict[str, Any]]:
+    if getattr(font, "layout_engine", None) == getattr(ImageFont.Layout, "RAQM", -1):
+        return text, {"direction": "rtl"}
+    if arabic_reshaper is not None:
+        return get_display(arabic_reshaper.reshape(text)), {}
+    return text, {}
+
+
+def _rasterise(text: str, font, fill, stroke_px: int, outline_only: bool, pad: int):
+    shaped, kwargs = _shape(text, font)
+    probe = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+    left, top, right, bottom = probe.textbbox((0, 0), shaped, font=font, stroke_width=stroke_px, **kwargs)
+    w, h = right - left + 2 * pad, bottom - top + 2 * pad
+    img = Image.new("RGBA", (w, h), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    xy = (pad - left, pad - top)
+    if outline_only:
+        draw.text(xy, shaped, font=font, fill=(0, 0, 0, 0), stroke_width=stroke_px,
+                  stroke_fill=fill, **kwargs)
+    else:
+        draw.text(xy, shaped, font=font, fill=fill, stroke_width=stroke_px, stroke_fill=fill, **kwargs)
+    return img
+
+
+def _transform(img, rotate_deg: float):
+    """Synthetic italic followed by Manim-style rotation (positive degrees =
+    counter-clockwise), resampled once as a single affine transform."""
+    w, h = img.size
+    theta = math.radians(rotate_deg)
+    cos, sin, k = math.cos(theta), math.sin(theta), SLANT_SHEAR
+
+    def forward(x, y):
+        x, y = x - w / 2, y - h / 2
+        x = x - k * y
+        return cos * x + sin * y, -sin * x + cos * y
+
+    corners = [forward(x, y) for x, y in ((0, 0), (w, 0), (0, h), (w, h))]
+    out_w = int(math.ceil(max(x for x, _ in corners) - min(x for x, _ in corners)))
+    out_h = int(math.ceil(max(y for _, y in corners) - min(y for _, y in corners)))
+
+    # inverse map, output pixel -> source pixel
+    a, b = cos + k * sin, -sin + k * cos
+    d, e = sin, cos
+    c = w / 2 - (a * out_w / 2 + b * out_h / 2)
+    f = h / 2 - (d * out_w / 2 + e * out_h / 2)
+    return img.transform((out_w, out_h), Image.AFFINE, (a, b, c, d, e, f), resample=Image.BILINEAR)
+
+
+class _Sprite:
+    """Only the visible pixels of a rasterised layer, premultiplied."""
+
+    def __init__(self, img):
+        arr = np.asarray(img)
+        self.height, self.width = arr.shape[:2]
+        self.rows, self.cols = np.nonzero(arr[..., 3])
+        values = arr[self.rows, self.cols].astype(np.float32) / 255.0
+        values[:, :3] *= values[:, 3:4]
+        self.values = values
+
+
+class _LineSprites:
+    def __init__(self, text: str, visual: Dict[str, Any], px_per_unit: float):
+        text_cfg = visual.get("text") or {}
+        base_scale = text_cfg.get("base_scale", 1.4)
+        rotate_deg = text_cfg.get("rotate_deg", -10)
+        stroke_width = text_cfg.get("stroke_width", 4.0)
+        font_name = visual.get("font_name", "Yekan")
+        size_px = EM_UNITS * px_per_unit * base_scale
+        # Manim stroke widths do not grow with .scale(); half of it shows outside the fill
+        stroke_px = max(1, int(round(stroke_width * STROKE_UNITS_PER_WIDTH * px_per_unit / 2)))
+        pad = stroke_px + 4
+
+        primary = _hex_rgb(visual.get("primary_color", "#F9F5FF")) + (255,)
+        accent = _hex_rgb(visual.get("accent_color", "#ec4899")) + (int(255 * 0.4),)
+
+        font = _load_font(font_name, max(8, int(size_px)))
+        self.stroke = _Sprite(_transform(_rasterise(text, font, accent, stroke_px, True, pad), rotate_deg))
+        self.pulse = []
+        for i in range(PULSE_LEVELS + 1):
+            scale = 1 + (PULSE_SCALE - 1) * i / PULSE_LEVELS
+            font = _load_font(font_name, max(8, int(size_px * scale)))
+            bold_px = max(1, int(size_px * scale) // 48)
+            self.pulse.append(_Sprite(_transform(_rasterise(text, font, primary, bold_px, False, pad), rotate_deg)))
+
+
+class _Canvas:
+    """Full-size RGBA frame that stays transparent; each frame only touches
+    the visible pixels of the current line's layers."""
+
+    def __init__(self, width: int, height: int, px_per_unit: float):
+        self.width = width
+        self.height = height
+        self.px_per_unit = px_per_unit
+        self.frame = np.zeros((height * width, 4), dtype=np.uint8)
+        self.acc = np.zeros((height * width, 4), dtype=np.float32)
+        self.blank = self.frame.tobytes()
+
+    def _indices(self, sprite: _Sprite, dy_units: float) -> Tuple["np.ndarray", "np.ndarray"]:
+        x0 = (self.width - sprite.width) // 2
+        # Manim's y axis points up, image rows point down
+        y0 = (self.height - sprite.height) // 2 - int(round(dy_units * self.px_per_unit))
+        ys, xs = sprite.rows + y0, sprite.cols + x0
+        keep = (ys >= 0) & (ys < self.height) & (xs >= 0) & (xs < self.width)
+        if keep.all():
+            return ys * self.width + xs, sprite.values
+        return ys[keep] * self.width + xs[keep], sprite.values[keep]
+
+    def compose(self, layers: List[Tuple[_Sprite, float, float]]) -> bytes:
+        touched = []
+        for sprite, dy_units, opacity in layers:
+            if opacity <= 0:
+                continue
+            idx, values = self._indices(sprite, dy_units)
+            src = values * opacity
+            self.acc[idx] = src + self.acc[idx] * (1.0 - src[:, 3:4])
+            touched.append(idx)
+        if not touched:
+            return self.blank
+
+        idx = np.concatenate(touched)
+        px = self.acc[idx]
+        alpha = px[:, 3:4]
+        np.divide(px[:, :3], alpha, out=px[:, :3], where=alpha > 0)
+        self.frame[idx] = (np.clip(px, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+        data = self.frame.tobytes()
+        self.frame[idx] = 0
+        self.acc[idx] = 0.0
+        return data
+
+
+def _line_frames(entry: Dict[str, Any], sprites: _LineSprites, canvas: _Canvas, fps: int):
+    """Yield the frames of one line: fade in, beat pulses, fade out."""
+    n = frame_count(FADE_IN, fps)
+    for i in range(n):
+        a = _smooth(i / n)
+        yield canvas.compose([
+            (sprites.stroke, 0.2 * (1 - a), a),
+            (sprites.pulse[0], -0.2 * (1 - a), a),
+        ])
+
+    # a pulse only ever shows PULSE_LEVELS + 1 distinct frames
+    levels: Dict[int, bytes] = {}
+
+    def at_level(level: int) -> bytes:
+        if level not in levels:
+            levels[level] = canvas.compose([(sprites.stroke, 0.0, 1.0), (sprites.pulse[level], 0.0, 1.0)])
+        return levels[level]
+
+    # same split as the Manim scene: one pulse animation, then a static wait
+    active = pulse_span(entry)
+    for i in range(frame_count(active, fps)):
+        phase = pulse_phase(entry, i / fps)
+        yield at_level(0 if phase is None else int(round(_there_and_back(phase) * PULSE_LEVELS)))
+
+    rest = at_level(0)
+    for _ in range(frame_count(entry["body"] - active, fps)):
+        yield rest
+
+    n = frame_count(FADE_OUT, fps)
+    for i in range(n):
+        a = _smooth(i / n)
+        yield canvas.compose([
+            (sprites.stroke, -0.3 * a, 1 - a),
+            (sprites.pulse[0], -0.3 * a, 1 - a),
+        ])
+
+
+def frame_size(quality: str = "h") -> Tuple[int, int, int]:
+    """(width, height, fps) of the overlay frames for a Manim quality flag."""
+    return QUALITIES.get(quality, QUALITIES["h"])
+
+
+def iter_frames(meta: Dict[str, Any], quality: str = "h"):
+    """Yield the overlay as raw RGBA frames, one bytes object per frame."""
+    if np is None or Image is None:
+        raise RuntimeError("رندر سریع به numpy و Pillow نیاز دارد.")
+
+    visual = meta.get("visual") or {}
+    text_cfg = visual.get("text") or {}
+    timeline: List[Dict[str, Any]] = meta.get("timeline") or plan_timeline(
+        meta.get("segments", []), text_cfg, meta.get("beats")
+    )
+    width, height, fps = frame_size(quality)
+    px_per_unit = height / FRAME_HEIGHT_UNITS
+    canvas = _Canvas(width, height, px_per_unit)
+    sprites: Dict[str, _LineSprites] = {}
+
+    for entry in timeline:
+        for _ in range(frame_count(entry["wait"], fps)):
+            yield canvas.blank
+        if entry["text"] not in sprites:
+            sprites[entry["text"]] = _LineSprites(entry["text"], visual, px_per_unit)
+        yield from _line_frames(entry, sprites[entry["text"]], canvas, fps)
+
+
+def rawvideo_input(quality: str = "h", source: str = "-") -> List[str]:
+    """ffmpeg input arguments for frames produced by iter_frames."""
+    width, height, fps = frame_size(quality)
+    return [
+        "-f", "rawvideo", "-pix_fmt", "rgba",
+        "-s", f"{width}x{height}", "-r", str(fps),
+        "-i", source,
+    ]
+
+
+def render_overlay(meta: Dict[str, Any], out_path: str, quality: str = "h") -> str:
+    if not available():
+        raise RuntimeError("رندر سریع به numpy، Pillow و ffmpeg نیاز دارد.")
+
+    cmd = ["ffmpeg", "-y", "-loglevel", "error"] + rawvideo_input(quality) + ["-c:v", "qtrle", out_path]
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+    try:
+        for frame in iter_frames(meta, quality):
+            proc.stdin.write(frame)
+        proc.stdin.close()
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        raise
+    if proc.wait() != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+    return out_path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("usage: fast_overlay.py META_JSON OUT_MOV [QUALITY]")
+        sys.exit(2)
+    with open(sys.argv[1], "r", encoding="utf-8") as f:
+        meta_arg = json.load(f)
+    render_overlay(meta_arg, sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else "h")
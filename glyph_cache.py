@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+On-disk store of shaped text geometry for the Manim scene.
+
+A Manim Text goes through Pango layout and SVG parsing; what comes out is
+just the bezier points of each glyph path. Those are saved per (text,
+font, weight, slant) so repeated lines, chunk processes and re-renders
+with other colors rebuild the mobject from the points instead.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from disk_cache import DiskCache
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+GLYPH_CACHE_DIR = os.environ.get(
+    "GLYPH_CACHE_DIR", os.path.join(BASE_DIR, "cache", "glyphs")
+)
+GLYPH_CACHE_MAX_BYTES = int(os.environ.get("GLYPH_CACHE_MAX_MB", "64")) * 1024 * 1024
+
+
+class GlyphCache(DiskCache):
+    suffix = ".npz"
+
+    def make_key(self, params: Dict[str, Any]) -> str:
+        payload = json.dumps(params, sort_keys=True, ensure_ascii=False)
+        return f"glyph_{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+    def get(self, key: str) -> Optional[List[np.ndarray]]:
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                paths = [data[f"p{i}"] for i in range(len(data.files))]
+        except (OSError, ValueError, KeyError):
+            self._count(hit=False)
+            return None
+        self._touch(path)
+        self._count(hit=True)
+        return paths
+
+    def put(self, key: str, paths: List[np.ndarray]):
+        dest = self._path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=self.suffix, dir=os.path.dirname(dest))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **{f"p{i}": p for i, p in enumerate(paths)})
+            os.replace(tmp_path, dest)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+
+
+GLYPH_CACHE = GlyphCache(GLYPH_CACHE_DIR, GLYPH_CACHE_MAX_BYTES)
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Retention and disk quota for what jobs leave on disk.
+
+    python janitor.py [--dry-run]
+
+- workdir/job_<key>/media and chunks (Manim partial movies, per-line
+  pieces) go RETAIN_SCRATCH_HOURS after they were last written, the rest
+  of a workdir (what a failed job resumes from) after RETAIN_WORKDIR_DAYS.
+- outputs/final_job_<key>.* that no Media row points to go after
+  RETAIN_ORPHAN_OUTPUT_DAYS.
+- uploads/project_*_job_* folders of finished jobs go after
+  RETAIN_UPLOAD_DAYS (0 keeps them); blobs of the upload store go with
+  their last link.
+
+Above DISK_QUOTA_GB the intermediates (scratch, workdirs, orphan outputs)
+are evicted least recently used first until usage is back under
+JANITOR_LOW_WATER of the quota. Nothing a queued or running job uses and no
+output referenced by Media is ever removed. The caches under cache/ have
+their own size limits and are only reported here.
+"""
+
+import os
+import sys
+import time
+import shutil
+import threading
+import traceback
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import or_
+
+from models import Job, Media, Project, get_session, ensure_job_columns
+from upload_store import UPLOAD_STORE
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+WORK_DIR = os.path.join(BASE_DIR, "workdir")
+OUTPUT_DIR = os.path.join(BASE_DIR, "outputs")
+UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
+CACHE_DIR = os.path.join(BASE_DIR, "cache")
+
+JANITOR = os.environ.get("JANITOR", "1") != "0"
+INTERVAL_SECONDS = float(os.environ.get("JANITOR_INTERVAL_SECONDS", "600"))
+RETAIN_SCRATCH_HOURS = float(os.environ.get("RETAIN_SCRATCH_HOURS", "6"))
+RETAIN_WORKDIR_DAYS = float(os.environ.get("RETAIN_WORKDIR_DAYS", "7"))
+RETAIN_ORPHAN_OUTPUT_DAYS = float(os.environ.get("RETAIN_ORPHAN_OUTPUT_DAYS", "30"))
+RETAIN_UPLOAD_DAYS = float(os.environ.get("RETAIN_UPLOAD_DAYS", "0"))
+DISK_QUOTA_BYTES = int(float(os.environ.get("DISK_QUOTA_GB", "0")) * 1024 ** 3)
+LOW_WATER = float(os.environ.get("JANITOR_LOW_WATER", "0.9"))
+
+ACTIVE_STATUSES = ("queued", "running")
+SCRATCH_DIRS = ("media", "chunks")
+# kinds the quota may evict, in no particular order: eviction is by age
+INTERMEDIATES = ("scratch", "workdir", "orphan_output")
+
+
+def _tree_usage(path: str) -> Tuple[int, int, float]:
+    """(apparent bytes, bytes of files not shared by hardlinks, newest mtime)."""
+    if os.path.isfile(path):
+        st = os.stat(path)
+        return st.st_size, st.st_size if st.st_nlink <= 1 else 0, st.st_mtime
+    total = own = 0
+    newest = 0.0
+    for root, _, files in os.walk(path):
+        for fn in files:
+            try:
+                st = os.stat(os.path.join(root, fn))
+            except OSError:
+                continue
+            total += st.st_size
+            if st.st_nlink <= 1:
+                own += st.st_size
+            newest = max(newest, st.st_mtime)
+    if not newest:
+        try:
+            newest = os.path.getmtime(path)
+        except OSError:
+            pass
+    return total, own, newest
+
+
+def _remove(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _item(kind: str, paths: List[str], project_id: Optional[int], protected: bool,
+          age_limit: Optional[float]) -> Dict[str, Any]:
+    size = own = 0
+    newest = 0.0
+    for path in paths:
+        s, o, m = _tree_usage(path)
+        size, own, newest = size + s, own + o, max(newest, m)
+    return {
+        "kind": kind,
+        "paths": paths,
+        "bytes": size,
+        "disk_bytes": own,
+        "mtime": newest,
+        "project_id": project_id,
+        "protected": protected,
+        "age_limit": age_limit,
+    }
+
+
+class Janitor:
+    def __init__(self, quota_bytes: int = DISK_QUOTA_BYTES, interval: float = INTERVAL_SECONDS):
+        self.quota_bytes = quota_bytes
+        self.interval = interval
+        self.runs = 0
+        self.removed = 0
+        self.freed_bytes = 0
+        self.last_run: Optional[float] = None
+        self.last_usage = 0
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    # ---- inventory ----
+    def _jobs(self):
+        db = get_session()
+        try:
+            jobs = db.query(
+                Job.work_key, Job.uuid, Job.project_id, Job.status,
+                Job.audio_path, Job.video_path, Job.audio_sha256, Job.video_sha256,
+            ).all()
+            referenced: Set[str] = set()
+            for file_path, poster_path in db.query(Media.file_path, Media.poster_path).all():
+                referenced.add(os.path.abspath(file_path))
+                if poster_path:
+                    referenced.add(os.path.abspath(poster_path))
+        finally:
+            db.close()
+        return jobs, referenced
+
+    def scan(self) -> List[Dict[str, Any]]:
+        jobs, referenced = self._jobs()
+        by_key: Dict[str, List[Any]] = {}
+        upload_dirs: Dict[str, List[Any]] = {}
+        for job in jobs:
+            by_key.setdefault(job.work_key or job.uuid, []).append(job)
+            for path in (job.audio_path, job.video_path):
+                if path:
+                    upload_dirs.setdefault(os.path.dirname(os.path.abspath(path)), []).append(job)
+
+        def active(group) -> bool:
+            return any(j.status in ACTIVE_STATUSES for j in group)
+
+        def project_of(group) -> Optional[int]:
+            return group[0].project_id if group else None
+
+        items = []
+        hour, day = 3600.0, 86400.0
+
+        if os.path.isdir(WORK_DIR):
+            for name in sorted(os.listdir(WORK_DIR)):
+                path = os.path.join(WORK_DIR, name)
+                if not (name.startswith("job_") and os.path.isdir(path)):
+                    continue
+                group = by_key.get(name[len("job_"):], [])
+                busy = active(group)
+                scratch = [os.path.join(path, d) for d in SCRATCH_DIRS if os.path.isdir(os.path.join(path, d))]
+                if scratch:
+                    items.append(_item("scratch", scratch, project_of(group), busy, RETAIN_SCRATCH_HOURS * hour))
+                rest = [os.path.join(path, fn) for fn in os.listdir(path) if fn not in SCRATCH_DIRS]
+                item = _item("workdir", rest, project_of(group), busy, RETAIN_WORKDIR_DAYS * day)
+                # measured without the scratch, removed as a whole
+                item["paths"] = [path]
+                items.append(item)
+
+        if os.path.isdir(OUTPUT_DIR):
+            groups: Dict[str, List[str]] = {}
+            for fn in os.listdir(OUTPUT_DIR):
+                # final_job_<key>.mp4 with its poster, sprite sheets and index
+                stem = fn.split("_sprite_")[0].split("_thumbs.")[0].rsplit(".", 1)[0]
+                groups.setdefault(stem, []).append(os.path.join(OUTPUT_DIR, fn))
+            for stem, paths in sorted(groups.items()):
+                key = stem[len("final_job_"):] if stem.startswith("final_job_") else None
+                group = by_key.get(key, []) if key else []
+                kept = any(os.path.abspath(p) in referenced for p in paths)
+                kind = "output" if kept else "orphan_output"
+                items.append(_item(kind, sorted(paths), project_of(group), kept or active(group),
+                                   None if kept else RETAIN_ORPHAN_OUTPUT_DAYS * day))
+
+        if os.path.isdir(UPLOAD_DIR):
+            for name in sorted(os.listdir(UPLOAD_DIR)):
+                path = os.path.join(UPLOAD_DIR, name)
+                if not (name.startswith("project_") and os.path.isdir(path)):
+                    continue
+                group = upload_dirs.get(os.path.abspath(path), [])
+                project_id = project_of(group)
+                if project_id is None:
+                    try:
+                        project_id = int(name.split("_")[1])
+                    except (IndexError, ValueError):
+                        project_id = None
+                item = _item("upload", [path], project_id, active(group),
+                             RETAIN_UPLOAD_DAYS * day if RETAIN_UPLOAD_DAYS > 0 else None)
+                item["digests"] = {
+                    os.path.abspath(p): digest
+                    for j in group
+                    for p, digest in ((j.audio_path, j.audio_sha256), (j.video_path, j.video_sha256))
+                    if digest
+                }
+                items.append(item)
+        return items
+
+    def usage(self, items: List[Dict[str, Any]]) -> int:
+        """Bytes on disk of everything managed: hardlinked uploads count once, as blobs."""
+        return sum(i["disk_bytes"] if i["kind"] == "upload" else i["bytes"] for i in items) \
+            + UPLOAD_STORE.stats()["bytes"]
+
+    # ---- removal ----
+    def _still_idle(self, item: Dict[str, Any]) -> bool:
+        # a requeue between scan and removal may have picked the workdir up again
+        if item["kind"] not in ("scratch", "workdir"):
+            return True
+        key = os.path.basename(item["paths"][0] if item["kind"] == "workdir"
+                               else os.path.dirname(item["paths"][0]))[len("job_"):]
+        db = get_session()
+        try:
+            return not db.query(Job.id).filter(
+                or_(Job.work_key == key, Job.uuid == key), Job.status.in_(ACTIVE_STATUSES)
+            ).first()
+        finally:
+            db.close()
+
+    def _release_uploads(self, folder: str, digests: Dict[str, str]):
+        for fn in os.listdir(folder):
+            path = os.path.abspath(os.path.join(folder, fn))
+            if path in digests:
+                UPLOAD_STORE.release(path, digests[path])
+        shutil.rmtree(folder, ignore_errors=True)
+
+    def _evict(self, item: Dict[str, Any], dry_run: bool) -> int:
+        if dry_run:
+            return item["bytes"]
+        if not self._still_idle(item):
+            return 0
+        for path in item["paths"]:
+            if item["kind"] == "upload":
+                self._release_uploads(path, item["digests"])
+            else:
+                _remove(path)
+        with self._lock:
+            self.removed += 1
+            self.freed_bytes += item["bytes"]
+        return item["bytes"]
+
+    def run_once(self, dry_run: bool = False) -> Dict[str, Any]:
+        with self._run_lock:
+            now = time.time()
+            items = self.scan()
+            removed: List[Dict[str, Any]] = []
+
+            for item in items:
+                if item["protected"] or item["age_limit"] is None:
+                    continue
+                if now - item["mtime"] > item["age_limit"] and self._evict(item, dry_run):
+                    removed.append({**item, "reason": "retention"})
+
+            gone = {id(i) for i in removed}
+            usage = self.usage(items) - sum(i["bytes"] for i in removed if i["kind"] != "upload")
+            if self.quota_bytes and usage > self.quota_bytes:
+                target = self.quota_bytes * LOW_WATER
+                candidates = sorted(
+                    (i for i in items
+                     if id(i) not in gone and not i["protected"] and i["kind"] in INTERMEDIATES),
+                    key=lambda i: i["mtime"],
+                )
+                for item in candidates:
+                    if usage <= target:
+                        break
+                    freed = self._evict(item, dry_run)
+                    if freed:
+                        usage -= freed
+                        removed.append({**item, "reason": "quota"})
+
+            if not dry_run:
+                UPLOAD_STORE.sweep_spools()
+            with self._lock:
+                self.runs += 1
+                self.last_run = now
+                self.last_usage = usage
+            return {
+                "usage_bytes": usage,
+                "quota_bytes": self.quota_bytes,
+                "removed": [
+                    {"kind": i["kind"], "paths": i["paths"], "bytes": i["bytes"], "reason": i["reason"]}
+                    for i in removed
+                ],
+            }
+
+    # ---- report ----
+    def report(self) -> Dict[str, Any]:
+        items = self.scan()
+        db = get_session()
+        try:
+            names = dict(db.query(Project.id, Project.name).all())
+        finally:
+            db.close()
+
+        totals: Dict[str, int] = {}
+        projects: Dict[Any, Dict[str, Any]] = {}
+        for item in items:
+            totals[item["kind"]] = totals.get(item["kind"], 0) + item["bytes"]
+            pid = item["project_id"]
+            entry = projects.setdefault(pid, {
+                "project_id": pid,
+                "name": names.get(pid) if pid is not None else None,
+                "bytes": 0,
+                "kinds": {},
+            })
+            entry["bytes"] += item["bytes"]
+            entry["kinds"][item["kind"]] = entry["kinds"].get(item["kind"], 0) + item["bytes"]
+
+        caches = {}
+        if os.path.isdir(CACHE_DIR):
+            for name in sorted(os.listdir(CACHE_DIR)):
+                caches[name] = _tree_usage(os.path.join(CACHE_DIR, name))[0]
+
+        return {
+            "usage_bytes": self.usage(items),
+            "quota_bytes": self.quota_bytes,
+            "totals": totals,
+            "uploads_store": UPLOAD_STORE.stats(),
+            "caches": caches,
+            "projects": sorted(projects.values(), key=lambda p: p["bytes"], reverse=True),
+            "janitor": self.stats(),
+        }
+
+    # ---- background ----
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception:
+                traceback.print_exc()
+
+    def start(self):
+        if self._thread is not None or not JANITOR:
+            return
+        self._thread = threading.Thread(target=self._loop, name="janitor", daemon=True)
+        self._thread.start()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self._thread is not None,
+                "runs": self.runs,
+                "removed": self.removed,
+                "freed_bytes": self.freed_bytes,
+                "last_run": self.last_run,
+                "last_usage_bytes": self.last_usage,
+            }
+
+
+JANITOR_INSTANCE = Janitor()
+
+
+def main(argv):
+    ensure_job_columns()
+    result = JANITOR_INSTANCE.run_once(dry_run="--dry-run" in argv)
+    for item in result["removed"]:
+        print(f"{item['reason']:9s} {item['kind']:13s} {item['bytes'] / 1024 ** 2:9.1f} MB  {item['paths'][0]}")
+    quota = f" / {result['quota_bytes'] / 1024 ** 3:.1f} GB" if result["quota_bytes"] else ""
+    print(f"usage {result['usage_bytes'] / 1024 ** 3:.2f} GB{quota}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Durable job queue on top of the `jobs` table.
+
+A worker claims a queued job by atomically flipping it to `running` and
+taking a lease; while the job runs the lease is renewed by heartbeats. A
+job whose lease expires (worker crashed, process restarted) is claimed
+again by the next free worker, up to JOB_MAX_ATTEMPTS times.
+"""
+
+import os
+import socket
+import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import update, or_, and_, func
+
+from models import Job, get_session
+
+LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+CLAIM_CANDIDATES = 50
+
+
+def make_worker_id(index: int) -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{index}"
+
+
+def _claimable(now: datetime.datetime):
+    return or_(
+        Job.status == "queued",
+        and_(Job.status == "running", Job.lease_expires_at < now),
+    )
+
+
+def claim_next_job(worker_id: str, last_served: Dict[int, float] | None = None,
+                   lease_seconds: float = LEASE_SECONDS) -> Optional[Job]:
+    last_served = last_served or {}
+    db = get_session()
+    try:
+        now = datetime.datetime.now()
+        candidates = (
+            db.query(Job)
+            .filter(_claimable(now))
+            .order_by(Job.priority.desc(), Job.created_at.asc(), Job.id.asc())
+            .limit(CLAIM_CANDIDATES)
+            .all()
+        )
+        if not candidates:
+            return None
+
+        running = dict(
+            db.query(Job.project_id, func.count(Job.id))
+            .filter(Job.status == "running", Job.lease_expires_at >= now)
+            .group_by(Job.project_id)
+            .all()
+        )
+        candidates.sort(key=lambda j: (
+            -(j.priority or 0),
+            running.get(j.project_id, 0),
+            last_served.get(j.project_id, 0.0),
+            j.created_at or now,
+            j.id,
+        ))
+
+        for cand in candidates:
+            if (cand.attempts or 0) >= JOB_MAX_ATTEMPTS:
+                db.execute(
+                    update(Job)
+                    .where(Job.id == cand.id, _claimable(now))
+                    .values(
+                        status="error",
+                        message="خطا در اجرای جاب",
+                        error="تعداد تلاش‌های اجرای جاب به سقف رسید.",
+                        lease_owner=None,
+                        lease_expires_at=None,
+                        updated_at=now,
+                    )
+                )
+                db.commit()
+                continue
+
+            res = db.execute(
+                update(Job)
+                .where(Job.id == cand.id, _claimable(now))
+                .values(
+                    status="running",
+                    lease_owner=worker_id,
+                    lease_expires_at=now + datetime.timedelta(seconds=lease_seconds),
+                    heartbeat_at=now,
+                    attempts=(Job.attempts + 1),
+                    started_at=now,
+                    updated_at=now,
+                )
+            )
+            db.commit()
+            if res.rowcount == 1:
+                job = db.get(Job, cand.id)
+                db.refresh(job)
+                db.expunge(job)
+                return job
+        return None
+    finally:
+        db.close()
+
+
+def heartbeat(job_id: int, worker_id: str, lease_seconds: float = LEASE_SECONDS) -> bool:
+    db = get_session()
+    try:
+        now = datetime.datetime.now()
+        res = db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.lease_owner == worker_id, Job.status == "running")
+            .values(
+                heartbeat_at=now,
+                lease_expires_at=now + datetime.timedelta(seconds=lease_seconds),
+            )
+        )
+        db.commit()
+        return res.rowcount == 1
+    finally:
+        db.close()
+
+
+def release(job_id: int, worker_id: str):
+    db = get_session()
+    try:
+        now = datetime.datetime.now()
+        db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.lease_owner == worker_id)
+            .values(lease_owner=None, lease_expires_at=None, finished_at=now)
+        )
+        # run_job always moves the job to a final state; if it could not
+        # (e.g. the DB write itself failed) hand the job back to the queue.
+        db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == "running", Job.lease_owner.is_(None))
+            .values(status="queued", message="در صف انتظار...", updated_at=now)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def recover_jobs() -> int:
+    """Requeue jobs left `running` by a previous process whose lease is gone."""
+    db = get_session()
+    try:
+        now = datetime.datetime.now()
+        res = db.execute(
+            update(Job)
+            .where(
+                Job.status == "running",
+                or_(Job.lease_expires_at.is_(None), Job.lease_expires_at < now),
+            )
+            .values(
+                status="queued",
+                message="بازیابی پس از راه‌اندازی مجدد؛ در صف انتظار...",
+                lease_owner=None,
+                lease_expires_at=None,
+                updated_at=now,
+            )
+        )
+        db.commit()
+        return res.rowcount
+    finally:
+        db.close()
+
+
+def queued_count() -> int:
+    db = get_session()
+    try:
+        return db.query(func.count(Job.id)).filter(Job.status == "queued").scalar() or 0
+    finally:
+        db.close()
+
+
+def queue_depth() -> Dict[str, Dict[str, float]]:
+    """Queued jobs per job type: how many, and how long the oldest has waited."""
+    db = get_session()
+    try:
+        rows = (
+            db.query(Job.job_type, func.count(Job.id), func.min(Job.created_at))
+            .filter(Job.status == "queued")
+            .group_by(Job.job_type)
+            .all()
+        )
+    finally:
+        db.close()
+    now = datetime.datetime.now()
+    return {
+        job_type or "standard": {
+            "queued": count,
+            "oldest_seconds": (now - oldest).total_seconds() if oldest else 0.0,
+        }
+        for job_type, count, oldest in rows
+    }
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+In-memory live state of jobs, in front of the `jobs` table.
+
+Progress updates of running jobs only touch memory; a background thread
+writes the latest progress/message of every job that changed since the
+last flush in a single transaction every JOB_STATE_FLUSH_SECONDS. The
+status endpoint reads running jobs from memory and other jobs through a
+short-lived snapshot, so neither more workers nor more open tabs add
+SQLite round-trips per update or per poll.
+
+Every change is also published to in-process subscribers (the SSE
+endpoints) as "status", "progress" and "stage" events.
+"""
+
+import os
+import time
+import queue
+import datetime
+import threading
+import traceback
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import update
+
+from models import Job, get_session
+
+FLUSH_SECONDS = float(os.environ.get("JOB_STATE_FLUSH_SECONDS", "2"))
+READ_TTL_SECONDS = float(os.environ.get("JOB_STATE_READ_TTL", "2"))
+SUBSCRIBER_BUFFER = 200
+
+
+def _stamp(dt: datetime.datetime) -> str:
+    return dt.isoformat(sep=" ", timespec="seconds")
+
+
+class JobStateStore:
+    def __init__(self, flush_interval: float = FLUSH_SECONDS, read_ttl: float = READ_TTL_SECONDS):
+        self.flush_interval = flush_interval
+        self.read_ttl = read_ttl
+        self._live: Dict[int, Dict[str, Any]] = {}
+        self._touched: Dict[int, datetime.datetime] = {}
+        self._dirty: Set[int] = set()
+        self._snapshots: Dict[int, Tuple[float, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._subscribers: List[Tuple[Optional[int], Optional[int], queue.Queue]] = []
+        self.updates = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.reads_served = 0
+        self.reads_loaded = 0
+
+    def subscribe(self, job_id: Optional[int] = None, project_id: Optional[int] = None) -> queue.Queue:
+        """Queue receiving the events of one job, of one project, or of all jobs."""
+        q: queue.Queue = queue.Queue(maxsize=SUBSCRIBER_BUFFER)
+        with self._lock:
+            self._subscribers.append((job_id, project_id, q))
+        return q
+
+    def unsubscribe(self, q: queue.Queue):
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s[2] is not q]
+
+    def _publish(self, kind: str, data: Dict[str, Any]):
+        # called with self._lock held
+        event = {"type": kind, "data": data}
+        for job_id, project_id, q in self._subscribers:
+            if job_id is not None and job_id != data.get("id"):
+                continue
+            if project_id is not None and project_id != data.get("project_id"):
+                continue
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # a stalled client loses intermediate events, not the worker's time
+                pass
+
+    def announce(self, job: Dict[str, Any]):
+        """Publish a status change committed outside the store (new job, requeue)."""
+        with self._lock:
+            self._snapshots.pop(job["id"], None)
+            self._publish("status", dict(job))
+
+    def begin(self, job: Dict[str, Any]):
+        """Start serving a job that this process is about to run."""
+        with self._lock:
+            self._live[job["id"]] = dict(job)
+            self._snapshots.pop(job["id"], None)
+            self._publish("status", dict(job))
+
+    def update(self, job_id: int, progress: int, message: str) -> bool:
+        """Record progress in memory; False if the job is no longer running."""
+        now = datetime.datetime.now()
+        with self._lock:
+            state = self._live.get(job_id)
+            if state is None or state.get("status") != "running":
+                return False
+            state["progress"] = progress
+            state["message"] = message
+            state["updated_at"] = _stamp(now)
+            self._touched[job_id] = now
+            self._dirty.add(job_id)
+            self.updates += 1
+            self._publish("progress", {
+                "id": job_id,
+                "project_id": state.get("project_id"),
+                "progress": progress,
+                "message": message,
+                "updated_at": state["updated_at"],
+            })
+        return True
+
+    def stage(self, job_id: int, name: str, timing: Dict[str, Any]):
+        """Record that a pipeline stage of a running job finished."""
+        with self._lock:
+            state = self._live.get(job_id)
+            if state is None:
+                return
+            stats = dict(state.get("stats") or {})
+            stats["stages"] = {**(stats.get("stages") or {}), name: timing}
+            state["stats"] = stats
+            self._publish("stage", {
+                "id": job_id,
+                "project_id": state.get("project_id"),
+                "stage": name,
+                **timing,
+            })
+
+    def cancel(self, job: Dict[str, Any]):
+        # the cancel itself is already committed by the caller
+        job_id = job["id"]
+        with self._lock:
+            state = self._live.get(job_id)
+            if state is not None:
+                state["status"] = job["status"]
+                state["message"] = job["message"]
+            self._dirty.discard(job_id)
+            self._snapshots.pop(job_id, None)
+            self._publish("status", dict(state if state is not None else job))
+
+    def cancelled(self, job_id: int) -> bool:
+        """True once a job this process runs was cancelled; the pipeline
+        polls this to stop between stages and kill its processes."""
+        with self._lock:
+            state = self._live.get(job_id)
+            return state is not None and state.get("status") == "cancelled"
+
+    def end(self, job_id: int, final: Optional[Dict[str, Any]] = None):
+        """Stop serving a job from memory once its final state is committed."""
+        with self._lock:
+            self._live.pop(job_id, None)
+            self._touched.pop(job_id, None)
+            self._dirty.discard(job_id)
+            if final is not None:
+                self._snapshots[job_id] = (time.monotonic(), final)
+                self._publish("status", dict(final))
+            else:
+                self._snapshots.pop(job_id, None)
+
+    def get(self, job_id: int, load: Callable[[int], Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            state = self._live.get(job_id)
+            if state is not None:
+                self.reads_served += 1
+                return dict(state)
+            cached = self._snapshots.get(job_id)
+            if cached is not None and now - cached[0] < self.read_ttl:
+                self.reads_served += 1
+                return dict(cached[1])
+        data = load(job_id)
+        with self._lock:
+            self.reads_loaded += 1
+            if data is not None:
+                self._snapshots[job_id] = (now, data)
+            if len(self._snapshots) > 1000:
+                cutoff = now - self.read_ttl
+                self._snapshots = {k: v for k, v in self._snapshots.items() if v[0] >= cutoff}
+        return data
+
+    def flush(self) -> int:
+        with self._lock:
+            batch = {
+                job_id: (self._live[job_id]["progress"], self._live[job_id]["message"], self._touched[job_id])
+                for job_id in self._dirty
+                if job_id in self._live
+            }
+            self._dirty.clear()
+        if not batch:
+            return 0
+
+        db = get_session()
+        try:
+            for job_id, (progress, message, touched) in batch.items():
+                # never overwrite a cancel or a final state written meanwhile
+                db.execute(
+                    update(Job)
+                    .where(Job.id == job_id, Job.status == "running")
+                    .values(progress=progress, message=message, updated_at=touched)
+                )
+            db.commit()
+        except Exception:
+            db.rollback()
+            with self._lock:
+                self._dirty.update(job_id for job_id in batch if job_id in self._live)
+            raise
+        finally:
+            db.close()
+        with self._lock:
+            self.flushes += 1
+            self.rows_written += len(batch)
+        return len(batch)
+
+    def _loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                traceback.print_exc()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="job-state-flush", daemon=True)
+        self._thread.start()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "live": len(self._live),
+                "dirty": len(self._dirty),
+                "updates": self.updates,
+                "flushes": self.flushes,
+                "rows_written": self.rows_written,
+                "reads_served": self.reads_served,
+                "reads_loaded": self.reads_loaded,
+                "subscribers": len(self._subscribers),
+            }
+
+
+JOB_STATE = JobStateStore()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Paged queries behind the project and job lists.
+
+Every page costs a fixed number of statements whatever the table sizes:
+rows are walked with keyset cursors on (created_at, id) instead of
+OFFSET, job counts come from a correlated subquery on ix_jobs_project_id,
+and the latest jobs of all projects on a page are fetched in one query.
+"""
+
+import os
+import json
+import base64
+import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, func, exists, tuple_
+from sqlalchemy.orm import Session, joinedload, load_only
+
+from models import Project, Job, Media
+
+PAGE_SIZE = int(os.environ.get("LIST_PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = 500
+GROUP_PAGE_SIZE = 20  # projects per page of the grouped job list
+JOBS_PER_PROJECT = int(os.environ.get("LIST_JOBS_PER_PROJECT", "10"))
+
+Cursor = Tuple[datetime.datetime, int]
+
+# what the grouped job list shows; stats, options and lease fields load on access
+LIST_JOB_COLUMNS = (
+    Job.id, Job.project_id, Job.config_id, Job.title, Job.tags, Job.job_type,
+    Job.status, Job.progress, Job.audio_path, Job.video_path, Job.created_at,
+)
+
+
+def encode_cursor(created_at: datetime.datetime, row_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), row_id])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Cursor]:
+    """None for a missing or malformed cursor, i.e. the first page."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        stamp, row_id = json.loads(raw)
+        return datetime.datetime.fromisoformat(stamp), int(row_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def page_limit(value, default: int = PAGE_SIZE) -> int:
+    try:
+        return max(1, min(MAX_PAGE_SIZE, int(value)))
+    except (TypeError, ValueError):
+        return default
+
+
+def _newest_first(stmt, model, after: Optional[Cursor], limit: int):
+    if after is not None:
+        # a row value, which SQLite turns into a range on ix_<table>_created_at;
+        # the equivalent OR expression scans the index from the top
+        stmt = stmt.where(tuple_(model.created_at, model.id) < tuple_(*after))
+    return stmt.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1)
+
+
+def _split_page(rows: list, limit: int, row_of=lambda r: r) -> Tuple[list, Optional[str]]:
+    # one extra row tells whether there is a next page
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = row_of(rows[-1])
+    return rows, encode_cursor(last.created_at, last.id)
+
+
+def project_page(db: Session, cursor: Optional[str] = None, limit: int = PAGE_SIZE,
+                 with_jobs: bool = False) -> Tuple[List[Tuple[Project, int]], Optional[str]]:
+    """(project, job count) pairs, newest first, and the cursor of the next page."""
+    job_count = (
+        select(func.count(Job.id))
+        .where(Job.project_id == Project.id)
+        .correlate(Project)
+        .scalar_subquery()
+    )
+    stmt = select(Project, job_count.label("job_count"))
+    if with_jobs:
+        stmt = stmt.where(exists().where(Job.project_id == Project.id))
+    stmt = _newest_first(stmt, Project, decode_cursor(cursor), limit)
+    rows = [(p, count) for p, count in db.execute(stmt).all()]
+    return _split_page(rows, limit, row_of=lambda r: r[0])
+
+
+def latest_jobs(db: Session, project_ids: List[int],
+                per_project: int = JOBS_PER_PROJECT) -> Dict[int, List[Job]]:
+    """The newest `per_project` jobs of each project, with their configs."""
+    if not project_ids:
+        return {}
+    ranked = (
+        select(
+            Job.id,
+            func.row_number().over(
+                partition_by=Job.project_id,
+                order_by=(Job.created_at.desc(), Job.id.desc()),
+            ).label("rank"),
+        )
+        .where(Job.project_id.in_(project_ids))
+        .subquery()
+    )
+    jobs = db.scalars(
+        select(Job)
+        .join(ranked, ranked.c.id == Job.id)
+        .where(ranked.c.rank <= per_project)
+        .options(load_only(*LIST_JOB_COLUMNS), joinedload(Job.config))
+        .order_by(Job.project_id, Job.created_at.desc(), Job.id.desc())
+    ).all()
+    grouped: Dict[int, List[Job]] = {pid: [] for pid in project_ids}
+    for job in jobs:
+        grouped[job.project_id].append(job)
+    return grouped
+
+
+def job_posters(db: Session, job_ids: List[int]) -> Dict[int, Media]:
+    """The newest media with a poster of each job, in one query; loading
+    every job's whole media collection cost as much as the jobs themselves."""
+    if not job_ids:
+        return {}
+    medias = db.scalars(
+        select(Media)
+        .where(Media.job_id.in_(job_ids), Media.poster_path.isnot(None))
+        .order_by(Media.id)
+    ).all()
+    return {m.job_id: m for m in medias}
+
+
+def job_page(db: Session, cursor: Optional[str] = None, limit: int = PAGE_SIZE,
+             project_id: Optional[int] = None, status: Optional[str] = None) -> Tuple[List[Job], Optional[str]]:
+    """Jobs newest first, optionally of one project and/or status."""
+    stmt = select(Job)
+    if project_id is not None:
+        stmt = stmt.where(Job.project_id == project_id)
+    if status:
+        stmt = stmt.where(Job.status == status)
+    stmt = _newest_first(stmt, Job, decode_cursor(cursor), limit)
+    return _split_page(list(db.scalars(stmt).all()), limit)
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Counters and histograms in the Prometheus text format, served at /metrics.
+
+Durations are recorded where the work happens (pipeline stages, the calls
+that drive Whisper, librosa, Manim and ffmpeg, the stage slots and the job
+queue); every external process is reaped with wait4 so its CPU time and
+peak RSS are recorded per tool. Levels that already live elsewhere (queue
+depth, cache hits, worker counts) are read from their owners by collectors
+at scrape time.
+"""
+
+import os
+import sys
+import time
+import bisect
+import functools
+import threading
+import subprocess
+import traceback
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+PREFIX = "motion_"
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+BYTES_BUCKETS = tuple(2 ** n * 1024 * 1024 for n in range(4, 15))  # 16 MiB .. 16 GiB
+# longest gap between two checks of a stop() callback while a process runs
+STOP_POLL_SECONDS = 0.5
+# ru_maxrss is in KiB on Linux and in bytes on macOS
+_MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+LabelKey = Tuple[Tuple[str, str], ...]
+Sample = Tuple[Dict[str, Any], float]
+
+
+def _key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(key: Iterable[Tuple[str, str]]) -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in key]
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_labels(key)} {_number(v)}" for key, v in values]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count per bucket..., count in +Inf only], sum, count
+        self._values: Dict[LabelKey, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0, 0]))
+            counts[i] += 1
+            total[0] += value
+            total[1] += 1
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, list(counts), list(total)) for key, (counts, total) in self._values.items())
+        lines = []
+        for key, counts, (value_sum, count) in values:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = key + (("le", _number(float(bound))),)
+                lines.append(f"{self.name}_bucket{_labels(le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(key)} {_number(value_sum)}")
+            lines.append(f"{self.name}_count{_labels(key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Any] = []
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._add(Counter(PREFIX + name, help))
+
+    def histogram(self, name: str, help: str, buckets: Tuple[float, ...] = DURATION_BUCKETS) -> Histogram:
+        return self._add(Histogram(PREFIX + name, help, buckets))
+
+    def _add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn: Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]):
+        """Register fn() -> [(name, kind, help, [(labels, value), ...]), ...],
+        called on every scrape; names get the same prefix as the metrics."""
+        with self._lock:
+            self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        for fn in collectors:
+            try:
+                families = list(fn())
+            except Exception:
+                # one broken source must not take the whole scrape down
+                traceback.print_exc()
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {PREFIX}{name} {help}")
+                lines.append(f"# TYPE {PREFIX}{name} {kind}")
+                lines.extend(
+                    f"{PREFIX}{name}{_labels(_key(labels))} {_number(value)}" for labels, value in samples
+                )
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram("stage_seconds", "Run time of pipeline stages that were not resumed.")
+STAGES_RESUMED = REGISTRY.counter("stages_resumed_total", "Pipeline stages reused from an earlier attempt.")
+STAGE_FAILURES = REGISTRY.counter("stage_failures_total", "Pipeline stages that raised.")
+CALL_SECONDS = REGISTRY.histogram("call_seconds", "Run time of instrumented calls.")
+CALL_FAILURES = REGISTRY.counter("call_failures_total", "Instrumented calls that raised.")
+SLOT_WAIT_SECONDS = REGISTRY.histogram("slot_wait_seconds", "Time spent waiting for a stage concurrency slot.")
+QUEUE_WAIT_SECONDS = REGISTRY.histogram("job_queue_wait_seconds", "Time from enqueue to the first claim of a job.")
+JOB_RUN_SECONDS = REGISTRY.histogram("job_run_seconds", "Time a worker spent on a job.")
+JOBS_FINISHED = REGISTRY.counter("jobs_finished_total", "Jobs that reached a final status in this process.")
+SUBPROCESS_CPU_SECONDS = REGISTRY.histogram(
+    "subprocess_cpu_seconds", "User+system CPU time of an external process and the children it waited for.")
+SUBPROCESS_MAX_RSS_BYTES = REGISTRY.histogram(
+    "subprocess_max_rss_bytes", "Peak resident set size of an external process.", BYTES_BUCKETS)
+SUBPROCESS_FAILURES = REGISTRY.counter("subprocess_failures_total", "External processes that exited non-zero.")
+
+
+def timed(fn):
+    """Record the run time of every call of fn in call_seconds{function}."""
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        t0 = time.monotonic()
+        try:
+            return fn(*args, **kwargs)
+        except BaseException:
+            CALL_FAILURES.inc(function=name)
+            raise
+        finally:
+            CALL_SECONDS.observe(time.monotonic() - t0, function=name)
+
+    return wrapper
+
+
+def _reap(proc: subprocess.Popen, stop: Callable[[], bool] | None):
+    """os.wait4 of proc; with `stop`, polled, killing proc once stop() is true."""
+    if stop is None:
+        return os.wait4(proc.pid, 0)
+    delay = 0.01
+    while True:
+        pid, status, usage = os.wait4(proc.pid, os.WNOHANG)
+        if pid:
+            return pid, status, usage
+        if stop():
+            proc.kill()
+            return os.wait4(proc.pid, 0)
+        time.sleep(delay)
+        delay = min(delay * 2, STOP_POLL_SECONDS)
+
+
+def wait(proc: subprocess.Popen, tool: str, stop: Callable[[], bool] | None = None) -> int:
+    """proc.wait(), recording the CPU time and peak RSS of the process.
+    With `stop`, the process is killed as soon as stop() returns true."""
+    if proc.returncode is not None or not hasattr(os, "wait4"):
+        while stop is not None and proc.poll() is None:
+            if stop():
+                proc.kill()
+                break
+            time.sleep(STOP_POLL_SECONDS)
+        return proc.wait()
+    try:
+        _, status, usage = _reap(proc, stop)
+    except ChildProcessError:
+        # reaped meanwhile by Popen itself
+        return proc.wait()
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    SUBPROCESS_CPU_SECONDS.observe(usage.ru_utime + usage.ru_stime, tool=tool)
+    SUBPROCESS_MAX_RSS_BYTES.observe(usage.ru_maxrss * _MAXRSS_UNIT, tool=tool)
+    if proc.returncode != 0:
+        SUBPROCESS_FAILURES.inc(tool=tool)
+    return proc.returncode
+
+
+def run(cmd: List[str], tool: str, check: bool = False, stop: Callable[[], bool] | None = None,
+        **kwargs) -> subprocess.CompletedProcess:
+    """subprocess.run for commands whose output is not captured, measured
+    like wait()."""
+    with subprocess.Popen(cmd, **kwargs) as proc:
+        try:
+            code = wait(proc, tool, stop)
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+    if check and code != 0:
+        raise subprocess.CalledProcessError(code, cmd)
+    return subprocess.CompletedProcess(cmd, code)
+
+
+def _rss_bytes() -> int | None:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+@REGISTRY.collector
+def _process_usage():
+    if resource is None:
+        return []
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    families = [
+        ("process_cpu_seconds_total", "counter", "CPU time of this process (Whisper and librosa run in it).",
+         [({}, own.ru_utime + own.ru_stime)]),
+        ("children_cpu_seconds_total", "counter", "CPU time of all reaped external processes.",
+         [({}, children.ru_utime + children.ru_stime)]),
+        ("process_max_rss_bytes", "gauge", "Peak resident set size of this process.",
+         [({}, own.ru_maxrss * _MAXRSS_UNIT)]),
+    ]
+    rss = _rss_bytes()
+    if rss is not None:
+        families.append(("process_resident_memory_bytes", "gauge", "Resident set size of this process.",
+                         [({}, rss)]))
+    return families
@@ -13,20 +13,50 @@ import datetime
 import json
 
 from sqlalchemy import (
-    create_engine, Column, Integer, String,
-    DateTime, Text, ForeignKey
+    create_engine, event, Column, Integer, String,
+    DateTime, Text, ForeignKey, Index
 )
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
 from sqlalchemy import inspect
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, "app.db")
+DB_PATH = os.environ.get("APP_DB_PATH", os.path.join(BASE_DIR, "app.db"))
 # NOTE: For SQLite, add/remove columns by deleting app.db once to recreate tables or
 # write a migration script; keep backups of your media/output paths if you do that.
 # After refactors (like moving audio/video paths off Project), drop the old app.db
 # or migrate manually so the new schema takes effect.
 
-engine = create_engine(f"sqlite:///{DB_PATH}", echo=False, future=True)
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+
+# one connection per thread at a time, checked out from a pool instead of
+# reopened per session; WAL lets request threads read while a worker commits
+engine = create_engine(
+    f"sqlite:///{DB_PATH}",
+    echo=False,
+    future=True,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_POOL_SIZE * 2,
+    pool_timeout=30,
+    connect_args={
+        "check_same_thread": False,
+        "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000.0,
+    },
+)
+
+
+@event.listens_for(engine, "connect")
+def _sqlite_pragmas(dbapi_conn, _record):
+    cur = dbapi_conn.cursor()
+    try:
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cur.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cur.close()
+
+
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
 Base = declarative_base()
@@ -42,11 +72,19 @@ class Project(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), nullable=False, unique=True)
     description = Column(Text, nullable=True, default="")
-    created_at = Column(DateTime, default=datetime.datetime.now)
+    created_at = Column(DateTime, default=datetime.datetime.now, index=True)
 
     jobs = relationship("Job", back_populates="project", cascade="all, delete-orphan")
     medias = relationship("Media", back_populates="project", cascade="all, delete-orphan")
 
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "description": self.description,
+            "created_at": self.created_at.isoformat(sep=" ", timespec="seconds") if self.created_at else None,
+        }
+
 
 class Config(Base):
     __tablename__ = "configs"
@@ -62,6 +100,7 @@ class Config(Base):
     font_name = Column(String(128), default="Yekan")
 
     music_type = Column(String(16), nullable=True)  # None: عمومی
+    whisper_model = Column(String(16), nullable=True)  # None: مدل پیش‌فرض
 
     advanced_json = Column(Text, default="{}")
 
@@ -83,6 +122,7 @@ class Config(Base):
             "bg_color": self.bg_color,
             "border_color": self.border_color,
             "font_name": self.font_name,
+            "whisper_model": self.whisper_model,
             "text": text_cfg,
             "video": video_cfg,
         }
@@ -90,35 +130,67 @@ class Config(Base):
 
 class Job(Base):
     __tablename__ = "jobs"
+    __table_args__ = (
+        # claim order of job_queue.claim_next_job
+        Index("ix_jobs_status_priority_created", "status", "priority", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     uuid = Column(String(64), nullable=False, unique=True)
-    project_id = Column(Integer, ForeignKey("projects.id"), nullable=False)
+    project_id = Column(Integer, ForeignKey("projects.id"), nullable=False, index=True)
 
     audio_path = Column(Text, nullable=False)
     video_path = Column(Text, nullable=False)
+    audio_sha256 = Column(String(64), nullable=True)  # content hash in upload_store
+    video_sha256 = Column(String(64), nullable=True)
     output_path = Column(Text, nullable=True)
 
     config_id = Column(Integer, ForeignKey("configs.id"), nullable=True)
 
     job_type = Column(String(64), default="standard")
     wizard_data = Column(Text, nullable=True)
+    whisper_model = Column(String(16), nullable=True)  # None: از کانفیگ
+    priority = Column(Integer, default=0)  # بزرگ‌تر = زودتر
+
+    # lease of the worker currently running the job (see job_queue.py)
+    lease_owner = Column(String(128), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    attempts = Column(Integer, default=0)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    work_key = Column(String(64), nullable=True)  # workdir/job_<work_key>, shared when resuming
+    stats_json = Column(Text, nullable=True)
+    render_options = Column(Text, nullable=True)  # JSON: quality, start/end of a preview, encoder
 
     title = Column(String(255), nullable=True)
     tags = Column(String(512), nullable=True)
 
-    status = Column(String(32), default="queued")  # queued, running, done, error, cancelled
+    status = Column(String(32), default="queued", index=True)  # queued, running, done, error, cancelled
     progress = Column(Integer, default=0)
     message = Column(Text, default="")
     error = Column(Text, nullable=True)
 
-    created_at = Column(DateTime, default=datetime.datetime.now)
+    created_at = Column(DateTime, default=datetime.datetime.now, index=True)
     updated_at = Column(DateTime, default=datetime.datetime.now)
 
     project = relationship("Project", back_populates="jobs")
     medias = relationship("Media", back_populates="job")
     config = relationship("Config", back_populates="jobs")
 
+    def stats(self):
+        try:
+            return json.loads(self.stats_json) if self.stats_json else {}
+        except Exception:
+            return {}
+
+    def options(self):
+        try:
+            return json.loads(self.render_options) if self.render_options else {}
+        except Exception:
+            return {}
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -126,10 +198,18 @@ class Job(Base):
             "project_id": self.project_id,
             "audio_path": self.audio_path,
             "video_path": self.video_path,
+            "audio_sha256": self.audio_sha256,
+            "video_sha256": self.video_sha256,
             "output_path": self.output_path,
             "config_id": self.config_id,
             "job_type": self.job_type,
             "wizard_data": self.wizard_data,
+            "whisper_model": self.whisper_model,
+            "priority": self.priority,
+            "attempts": self.attempts,
+            "work_key": self.work_key,
+            "stats": self.stats(),
+            "render_options": self.options(),
             "title": self.title,
             "tags": self.tags,
             "status": self.status,
@@ -138,6 +218,8 @@ class Job(Base):
             "error": self.error,
             "created_at": self.created_at.isoformat(sep=" ", timespec="seconds") if self.created_at else None,
             "updated_at": self.updated_at.isoformat(sep=" ", timespec="seconds") if self.updated_at else None,
+            "started_at": self.started_at.isoformat(sep=" ", timespec="seconds") if self.started_at else None,
+            "finished_at": self.finished_at.isoformat(sep=" ", timespec="seconds") if self.finished_at else None,
         }
 
 
@@ -145,16 +227,24 @@ class Media(Base):
     __tablename__ = "media"
 
     id = Column(Integer, primary_key=True, index=True)
-    project_id = Column(Integer, ForeignKey("projects.id"), nullable=False)
-    job_id = Column(Integer, ForeignKey("jobs.id"), nullable=True)
+    project_id = Column(Integer, ForeignKey("projects.id"), nullable=False, index=True)
+    job_id = Column(Integer, ForeignKey("jobs.id"), nullable=True, index=True)
 
     file_path = Column(Text, nullable=False)
     media_type = Column(String(32), default="video")
+    poster_path = Column(Text, nullable=True)
+    sprite_json = Column(Text, nullable=True)  # JSON: sheets, interval, tile, grid, duration
     created_at = Column(DateTime, default=datetime.datetime.now)
 
     project = relationship("Project", back_populates="medias")
     job = relationship("Job", back_populates="medias")
 
+    def sprite(self):
+        try:
+            return json.loads(self.sprite_json) if self.sprite_json else {}
+        except Exception:
+            return {}
+
 
 def ensure_default_configs():
     db = get_session()
@@ -299,20 +389,63 @@ def ensure_default_configs():
         db.close()
 
 
-def ensure_job_columns():
-    """Ensure new Job columns exist even on older SQLite files."""
+def _add_missing_columns(table: str, wanted: dict):
     inspector = inspect(engine)
-    columns = {col['name'] for col in inspector.get_columns('jobs')}
-
-    alter_sql = []
-    if "job_type" not in columns:
-        alter_sql.append("ALTER TABLE jobs ADD COLUMN job_type VARCHAR(64) DEFAULT 'standard'")
-    if "wizard_data" not in columns:
-        alter_sql.append("ALTER TABLE jobs ADD COLUMN wizard_data TEXT")
+    columns = {col['name'] for col in inspector.get_columns(table)}
 
+    alter_sql = [
+        f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"
+        for name, ddl in wanted.items()
+        if name not in columns
+    ]
     if not alter_sql:
         return
 
     with engine.begin() as conn:
         for stmt in alter_sql:
             conn.exec_driver_sql(stmt)
+
+
+def _add_missing_indexes(table):
+    # create_all only builds indexes together with a new table
+    existing = {ix["name"] for ix in inspect(engine).get_indexes(table.name)}
+    missing = [ix for ix in table.indexes if ix.name not in existing]
+    if not missing:
+        return
+
+    with engine.begin() as conn:
+        for ix in missing:
+            ix.create(conn, checkfirst=True)
+        conn.exec_driver_sql(f"ANALYZE {table.name}")
+
+
+def ensure_job_columns():
+    """Ensure new Job/Config/Media columns and indexes exist even on older SQLite files."""
+    _add_missing_columns("jobs", {
+        "job_type": "VARCHAR(64) DEFAULT 'standard'",
+        "wizard_data": "TEXT",
+        "whisper_model": "VARCHAR(16)",
+        "priority": "INTEGER DEFAULT 0",
+        "lease_owner": "VARCHAR(128)",
+        "lease_expires_at": "DATETIME",
+        "heartbeat_at": "DATETIME",
+        "attempts": "INTEGER DEFAULT 0",
+        "started_at": "DATETIME",
+        "finished_at": "DATETIME",
+        "work_key": "VARCHAR(64)",
+        "stats_json": "TEXT",
+        "render_options": "TEXT",
+        "audio_sha256": "VARCHAR(64)",
+        "video_sha256": "VARCHAR(64)",
+    })
+    _add_missing_columns("configs", {
+        "whisper_model": "VARCHAR(16)",
+    })
+    _add_missing_columns("media", {
+        "poster_path": "TEXT",
+        "sprite_json": "TEXT",
+    })
+    # after the columns, since the claim index covers jobs.priority
+    _add_missing_indexes(Project.__table__)
+    _add_missing_indexes(Job.__table__)
+    _add_missing_indexes(Media.__table__)
@@ -2,12 +2,22 @@ from __future__ import annotations
 # -*- coding: utf-8 -*-
 
 import os
+import sys
 import json
 import math
 from typing import Dict, Any, List
 
+import manim
 from manim import *
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from timeline import plan_timeline, pulse_phase, pulse_span  # noqa: E402
+from glyph_cache import GLYPH_CACHE  # noqa: E402
+
+# shaped text per glyph cache key, reused for repeated lines in this render
+_TEXT_TEMPLATES: Dict[str, VMobject] = {}
+_GLYPH_STATS = {"memory": 0, "disk": 0, "shaped": 0}
+
 
 def load_meta() -> Dict[str, Any]:
     meta_path = os.environ.get("FARSI_MOTION_META")
@@ -17,6 +27,33 @@ def load_meta() -> Dict[str, Any]:
         return json.load(f)
 
 
+def shaped_text(text: str, font: str) -> VMobject:
+    """Bold italic geometry of `text`, uncolored. Pango/SVG only run when
+    neither this process nor the on-disk glyph cache has it yet."""
+    key = GLYPH_CACHE.make_key({
+        "text": text,
+        "font": font,
+        "weight": BOLD,
+        "slant": ITALIC,
+        "manim": manim.__version__,
+    })
+    template = _TEXT_TEMPLATES.get(key)
+    if template is not None:
+        _GLYPH_STATS["memory"] += 1
+        return template.copy()
+
+    paths = GLYPH_CACHE.get(key)
+    if paths is not None:
+        template = VGroup(*[VMobject().set_points(p) for p in paths])
+        _GLYPH_STATS["disk"] += 1
+    else:
+        template = Text(text, font=font, slant=ITALIC, weight=BOLD)
+        GLYPH_CACHE.put(key, [m.points for m in template.family_members_with_points()])
+        _GLYPH_STATS["shaped"] += 1
+    _TEXT_TEMPLATES[key] = template
+    return template.copy()
+
+
 class FarsiKinetic(Scene):
     def construct(self):
         meta = load_meta()
@@ -31,31 +68,20 @@ class FarsiKinetic(Scene):
         base_scale = text_cfg.get("base_scale", 1.4)
         rotate_deg = text_cfg.get("rotate_deg", -10)
         stroke_width = text_cfg.get("stroke_width", 4.0)
-        pulse_rt = text_cfg.get("pulse_rt", 0.09)
-
-        segments: List[Dict[str, Any]] = meta.get("segments", [])
-        if not segments:
-            segments = [{"start": 0.0, "end": 4.0, "text": "نمونه موشن فارسی"}]
-
-        current_time = 0.0
-        for seg in segments:
-            start = float(seg.get("start", 0.0))
-            end = float(seg.get("end", start + 3.0))
-            duration = max(0.5, end - start)
-            text = seg.get("text", "").strip() or "..."
-
-            gap = max(0.0, start - current_time)
-            if gap > 0:
-                self.wait(gap)
-                current_time += gap
-
-            line = Text(
-                text,
-                font=font_name,
-                color=primary_color,
-                slant=ITALIC,
-                weight=BOLD,
-            )
+
+        # a chunk render gets its slice of the timeline precomputed
+        timeline: List[Dict[str, Any]] = meta.get("timeline") or plan_timeline(
+            meta.get("segments", []), text_cfg, meta.get("beats")
+        )
+
+        for entry in timeline:
+            text = entry["text"]
+
+            if entry["wait"] > 0:
+                self.wait(entry["wait"])
+
+            line = shaped_text(text, font_name)
+            line.set_fill(primary_color, opacity=1.0).set_stroke(primary_color, width=0)
             line.scale(base_scale)
             line.rotate(math.radians(rotate_deg))
             line.move_to(ORIGIN)
@@ -72,18 +98,32 @@ class FarsiKinetic(Scene):
                 run_time=0.5,
             )
 
-            pulses = max(1, int(duration / max(pulse_rt, 0.4)))
-            for _ in range(pulses):
-                self.play(
-                    line.animate.scale(1.04),
-                    stroke.animate.set_stroke(width=stroke_width + 1.0),
-                    run_time=pulse_rt,
-                    rate_func=there_and_back,
-                )
+            # all of a line's beat pulses run as one updater-driven animation
+            active = pulse_span(entry)
+            if active > 0:
+                current = {"scale": 1.0}
+
+                def pulse(mob, alpha):
+                    phase = pulse_phase(entry, alpha * active)
+                    amount = 0.0 if phase is None else there_and_back(phase)
+                    target = 1.0 + 0.04 * amount
+                    line.scale(target / current["scale"])
+                    current["scale"] = target
+                    stroke.set_stroke(width=stroke_width + amount)
 
-            self.wait(max(0.2, duration - pulses * pulse_rt))
+                self.play(UpdateFromAlphaFunc(group, pulse), run_time=active, rate_func=linear)
+
+            if entry["body"] > active:
+                self.wait(entry["body"] - active)
             self.play(
                 FadeOut(group, shift=0.3 * DOWN),
                 run_time=0.5,
             )
-            current_time = end
+
+        lookups = sum(_GLYPH_STATS.values())
+        if lookups:
+            logger.info(
+                "glyph cache: %d lines, %d memory hits, %d disk hits, %d shaped (hit rate %.0f%%)",
+                lookups, _GLYPH_STATS["memory"], _GLYPH_STATS["disk"], _GLYPH_STATS["shaped"],
+                100.0 * (lookups - _GLYPH_STATS["shaped"]) / lookups,
+            )
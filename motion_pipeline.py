@@ -2,21 +2,220 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
+import glob
 import json
+import time
+import shutil
+import struct
+import hashlib
+import threading
+import traceback
 import subprocess
 import uuid
-from typing import Callable, Dict, Any
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Any, List, Tuple
 
-from transcribe import transcribe_audio
+from transcribe import transcribe_audio, options_for
 from beat_analysis import analyze_beats
+from scheduler import stage_slot
+from timeline import (
+    plan_timeline, split_timeline, clip_segments, clip_beats,
+    frame_count, line_frames, standalone_entry,
+)
+from render_cache import RENDER_CACHE, SEGMENT_CACHE_ENABLED
+import fast_overlay
+import metrics
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIM_CHUNKS = int(os.environ.get("MANIM_CHUNKS", str(os.cpu_count() or 1)))
+MANIM_MIN_CHUNK_SECONDS = float(os.environ.get("MANIM_MIN_CHUNK_SECONDS", "20"))
+# render per-line clips while Whisper is still transcribing later lines
+STREAM_RENDER = os.environ.get("STREAM_RENDER", "1") != "0"
+
+# libx264 settings for the final composite; a Config picks one with
+# "encoder" in its video JSON and may override single keys next to it
+ENCODER_PROFILES: Dict[str, Dict[str, Any]] = {
+    "draft": {"preset": "ultrafast", "crf": 30, "tune": "fastdecode", "threads": 0},
+    "fast": {"preset": "veryfast", "crf": 23, "threads": 0},
+    "standard": {"preset": "medium", "crf": 23, "threads": 0},
+    "quality": {"preset": "slow", "crf": 18, "threads": 0},
+}
+DEFAULT_ENCODER_PROFILE = os.environ.get("ENCODER_PROFILE", "standard")
+# faststart: moov atom up front, so playback starts before the download ends;
+# fragmented: moof per keyframe, playable (and streamable) while still written
+MP4_LAYOUTS: Dict[str, List[str]] = {
+    "faststart": ["-movflags", "+faststart"],
+    "fragmented": ["-movflags", "+frag_keyframe+empty_moov+default_base_moof"],
+}
+DEFAULT_MP4_LAYOUT = os.environ.get("MP4_LAYOUT", "faststart")
+
+# poster frame and scrub sprite sheets, cut from the composite in its encode pass
+THUMBNAILS = os.environ.get("THUMBNAILS", "1") != "0"
+POSTER_WIDTH = 640
+SPRITE_INTERVAL = float(os.environ.get("SPRITE_INTERVAL", "2"))
+SPRITE_TILE = (160, 90)
+SPRITE_GRID = (10, 10)
+# the piped composite reads a pre-filtered base video; visually lossless is
+# enough for an intermediate that is encoded once more
+PREFILTER_CRF = int(os.environ.get("PREFILTER_CRF", "16"))
+
+
+class JobCancelled(Exception):
+    """The job was cancelled while its pipeline ran."""
 
 
 def _ensure_dir(path: str):
     os.makedirs(path, exist_ok=True)
 
 
+def _fingerprint(data: Any) -> str:
+    raw = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _result_usable(result: Any) -> bool:
+    # stages that produce files return their path; a resumed stage is only
+    # reused if the file it made is still on disk
+    if isinstance(result, str) and os.path.isabs(result):
+        return os.path.exists(result)
+    return True
+
+
+class Stage:
+    def __init__(self, name: str, fn: Callable[[Dict[str, Any]], Any],
+                 deps: Tuple[str, ...] = (), inputs: Any = None,
+                 progress: int = 0, message: str = ""):
+        self.name = name
+        self.fn = fn
+        self.deps = deps
+        self.inputs = inputs
+        self.progress = progress
+        self.message = message
+
+
+class StageGraph:
+    """Runs stages as soon as their dependencies finish; independent stages
+    run concurrently. Completed stages are recorded in stages.json so a
+    failed job can resume from where it stopped. Once `stop()` is true no
+    further stage starts and the run raises JobCancelled."""
+
+    def __init__(self, stages: List[Stage], state_path: str,
+                 on_stage: Callable[[str, Dict[str, Any]], None] | None = None,
+                 stop: Callable[[], bool] | None = None):
+        self.stages = {s.name: s for s in stages}
+        self.state_path = state_path
+        self.on_stage = on_stage
+        self.stop = stop
+        self.state = self._load_state()
+        self.timings: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _load_state(self) -> Dict[str, Any]:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault("completed", {})
+        return state
+
+    def _save_state(self):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def _reusable(self, stage: Stage, rerun: set) -> bool:
+        done = self.state["completed"].get(stage.name)
+        if not done or any(d in rerun for d in stage.deps):
+            return False
+        if done.get("inputs") != _fingerprint(stage.inputs):
+            return False
+        return _result_usable(done.get("result"))
+
+    def _run_stage(self, stage: Stage, results: Dict[str, Any]) -> Tuple[Any, float]:
+        t0 = time.monotonic()
+        try:
+            result = stage.fn(results)
+        except BaseException:
+            metrics.STAGE_FAILURES.inc(stage=stage.name)
+            raise
+        seconds = time.monotonic() - t0
+        metrics.STAGE_SECONDS.observe(seconds, stage=stage.name)
+        return result, seconds
+
+    def _report(self, name: str):
+        if self.on_stage:
+            try:
+                self.on_stage(name, dict(self.timings[name]))
+            except Exception:
+                traceback.print_exc()
+
+    def run(self, update: Callable[[int, str], None]) -> Dict[str, Any]:
+        results: Dict[str, Any] = {}
+        timings = self.timings
+        rerun: set = set()
+        pending = dict(self.stages)
+        running: Dict[Any, Stage] = {}
+        failure: Exception | None = None
+
+        with ThreadPoolExecutor(max_workers=len(self.stages)) as pool:
+            while pending or running:
+                if pending and self.stop is not None and self.stop():
+                    failure = failure or JobCancelled()
+                    pending.clear()
+                ready = [s for s in pending.values() if all(d in results for d in s.deps)]
+                for stage in ready:
+                    del pending[stage.name]
+                    if self._reusable(stage, rerun):
+                        done = self.state["completed"][stage.name]
+                        results[stage.name] = done["result"]
+                        timings[stage.name] = {"seconds": done.get("seconds", 0.0), "resumed": True}
+                        metrics.STAGES_RESUMED.inc(stage=stage.name)
+                        self._report(stage.name)
+                        continue
+                    update(stage.progress, stage.message)
+                    running[pool.submit(self._run_stage, stage, dict(results))] = stage
+
+                if not running:
+                    if failure is not None:
+                        break
+                    if pending and not ready:
+                        raise RuntimeError(f"وابستگی حل‌نشده در مراحل: {', '.join(pending)}")
+                    continue
+
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    stage = running.pop(fut)
+                    try:
+                        result, seconds = fut.result()
+                    except Exception as e:
+                        # let the stages already running finish and be
+                        # recorded so a retry can resume from them
+                        failure = failure or e
+                        pending.clear()
+                        continue
+                    results[stage.name] = result
+                    rerun.add(stage.name)
+                    timings[stage.name] = {"seconds": round(seconds, 3), "resumed": False}
+                    self._report(stage.name)
+                    with self._lock:
+                        self.state["completed"][stage.name] = {
+                            "result": result,
+                            "seconds": round(seconds, 3),
+                            "inputs": _fingerprint(stage.inputs),
+                        }
+                        self._save_state()
+
+        if failure is not None:
+            if self.stop is not None and self.stop() and not isinstance(failure, JobCancelled):
+                # a stage whose process was killed by the cancel
+                raise JobCancelled() from failure
+            raise failure
+        return results
+
+
 def process_job(
     audio_path: str,
     video_path: str,
@@ -24,85 +223,790 @@ def process_job(
     progress_callback: Callable[[int, str], None] | None = None,
     quality: str = "h",
     config: Dict[str, Any] | None = None,
+    whisper_model: str = "small",
+    job_key: str | None = None,
+    stats: Dict[str, Any] | None = None,
+    clip: Tuple[float, float] | None = None,
+    encoder: str | None = None,
+    stage_callback: Callable[[str, Dict[str, Any]], None] | None = None,
+    stop: Callable[[], bool] | None = None,
 ) -> str:
-    job_id = str(uuid.uuid4())[:8]
-    job_tmp = os.path.join(BASE_DIR, "workdir", f"job_{job_id}")
+    """Run the pipeline of one job and return the path of the final video.
+    `stop` is polled between stages and while external processes run; once
+    it is true they are killed and JobCancelled is raised."""
+    job_key = job_key or str(uuid.uuid4())[:8]
+    job_tmp = os.path.join(BASE_DIR, "workdir", f"job_{job_key}")
     _ensure_dir(job_tmp)
     _ensure_dir(output_dir)
 
-    def update(p, m):
-        if progress_callback:
-            progress_callback(p, m)
-
-    update(10, "در حال تبدیل و تشخیص گفتار (Whisper)...")
-    segments, _ = transcribe_audio(audio_path, job_tmp)
+    update_lock = threading.Lock()
+    reached = [0]
 
-    update(25, "تحلیل ضرب آهنگ (Beat Tracking)...")
-    _, beats_list = analyze_beats(audio_path, job_tmp)
+    def update(p, m):
+        # stages report from several threads; keep the bar monotonic
+        with update_lock:
+            if p < reached[0]:
+                return
+            reached[0] = p
+            if progress_callback:
+                progress_callback(p, m)
 
-    update(40, "آماده‌سازی کانفیگ بصری برای Manim...")
     config = config or {}
     if not isinstance(config, dict):
         config = {}
     text_cfg = config.get("text") or {}
     video_cfg = config.get("video") or {}
+    if encoder:
+        video_cfg = {**video_cfg, "encoder": encoder}
     config = {**config, "text": text_cfg, "video": video_cfg}
-    meta = {
-        "audio_path": audio_path,
-        "video_path": video_path,
-        "segments": segments,
-        "beats": beats_list,
-        "visual": config,
-    }
-    meta_path = os.path.join(job_tmp, "meta.json")
-    with open(meta_path, "w", encoding="utf-8") as f:
-        json.dump(meta, f, ensure_ascii=False, indent=2)
+    clip = (float(clip[0]), float(clip[1])) if clip else None
+    final_out = os.path.join(output_dir, f"final_job_{job_key}.mp4")
+    # the fast renderer can stream its frames into the composite directly
+    piped = (
+        video_cfg.get("compose") == "pipe"
+        and text_cfg.get("renderer") == "fast"
+        and fast_overlay.available()
+    )
+    encode: Dict[str, Any] = {}
+
+    # with the segment cache on, the per-line clips of early lines can be
+    # rendered into it while Whisper is still on the later ones
+    streaming = STREAM_RENDER and SEGMENT_CACHE_ENABLED and not piped
+    prerender: List[LinePrerenderer] = []
+    # set by the beats stage (or from its resumed result); the prerenderer
+    # waits on it, Whisper does not
+    beats_ready: "Future[List[float]]" = Future()
+
+    whisper_options = options_for(text_cfg)
+
+    def transcribe_stage(results):
+        prerender_add = None
+        if streaming:
+            if "beats" in results and not beats_ready.done():
+                beats_ready.set_result(results["beats"])
+            pre = LinePrerenderer(config, beats_ready, os.path.join(job_tmp, "chunks"),
+                                  quality, MANIM_CHUNKS, clip=clip, stop=stop)
+            prerender.append(pre)
+            prerender_add = pre.add
+
+        def on_segment(seg):
+            # Whisper runs in this process: a cancel stops it between segments
+            if stop is not None and stop():
+                raise JobCancelled()
+            if prerender_add:
+                prerender_add(seg)
+
+        with stage_slot("whisper"):
+            # a preview only needs the lines up to the end of its window
+            segments, _ = transcribe_audio(audio_path, job_tmp, model_name=whisper_model,
+                                           on_segment=on_segment, until=clip[1] if clip else None,
+                                           **whisper_options)
+        return segments
+
+    def beats_stage(results):
+        try:
+            with stage_slot("beats"):
+                _, beats_list = analyze_beats(audio_path, job_tmp, window=clip)
+        except BaseException as e:
+            beats_ready.set_exception(e)
+            raise
+        beats_ready.set_result(beats_list)
+        return beats_list
+
+    def prefilter_stage(results):
+        with stage_slot("ffmpeg"):
+            return prefilter_video(video_path, job_tmp, video_cfg, clip=clip, stop=stop)
+
+    def meta_stage(results):
+        segments, beats_list = results["transcribe"], results["beats"]
+        if clip:
+            # a preview analyses the song up to (beats: only within) its
+            # window; the full render does the whole song
+            segments = clip_segments(segments, *clip)
+            beats_list = clip_beats(beats_list, *clip)
+        meta = {
+            "audio_path": audio_path,
+            "video_path": video_path,
+            "segments": segments,
+            "beats": beats_list,
+            "visual": config,
+            "clip": list(clip) if clip else None,
+        }
+        meta_path = os.path.join(job_tmp, "meta.json")
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        return meta_path
+
+    def manim_stage(results):
+        for pre in prerender:
+            pre.wait()
+        return render_chunked(results["meta"], quality=quality, stop=stop)
 
-    update(60, "رندر متن با Manim...")
-    manim_video = run_manim(meta_path, quality=quality)
+    def compose_stage(results):
+        with stage_slot("ffmpeg"):
+            if piped:
+                info = overlay_piped(results["prefilter"], results["meta"], audio_path, final_out,
+                                     {**video_cfg, "filter_chain": ""}, quality=quality, clip=clip,
+                                     thumbnails=THUMBNAILS, stop=stop)
+            else:
+                # filter_chain and the preview window are applied to the base
+                # video in this same pass; no intermediate is written
+                info = overlay_with_ffmpeg(video_path, results["manim"], audio_path, final_out,
+                                           video_cfg, clip=clip, clip_base=True,
+                                           thumbnails=THUMBNAILS, stop=stop)
+        encode.update(info)
+        return final_out
 
-    update(80, "ترکیب ویدیو زمینه و متن (ffmpeg)...")
-    final_out = os.path.join(output_dir, f"final_job_{job_id}.mp4")
-    overlay_with_ffmpeg(video_path, manim_video, audio_path, final_out, (config.get("video") if config else {}) or {})
+    def thumbnails_stage(results):
+        return write_thumbnail_index(results["compose"])
 
+    overlay_stages = [
+        Stage("prefilter", prefilter_stage,
+              inputs={"video": video_path, "filter_chain": video_cfg.get("filter_chain", ""),
+                      "clip": clip, "crf": PREFILTER_CRF},
+              progress=10, message="آماده‌سازی ویدیو زمینه (ffmpeg)..."),
+    ] if piped else [
+        Stage("manim", manim_stage, deps=("meta",),
+              inputs={"quality": quality, "chunks": MANIM_CHUNKS, "segment_cache": SEGMENT_CACHE_ENABLED},
+              progress=60, message="رندر متن با Manim..."),
+    ]
+
+    graph = StageGraph([
+        # beats first: a resumed beats result is then in place when the
+        # transcribe stage starts next to it
+        Stage("beats", beats_stage,
+              inputs={"audio": audio_path, "clip": clip},
+              progress=10, message="تحلیل ضرب آهنگ (Beat Tracking)..."),
+        Stage("transcribe", transcribe_stage,
+              inputs={"audio": audio_path, "model": whisper_model, "clip": clip, **whisper_options},
+              progress=10, message="در حال تبدیل و تشخیص گفتار (Whisper)..."),
+        Stage("meta", meta_stage, deps=("transcribe", "beats"),
+              inputs={"visual": config, "clip": clip},
+              progress=40, message="آماده‌سازی کانفیگ بصری برای Manim..."),
+        *overlay_stages,
+        Stage("compose", compose_stage,
+              deps=("meta", "prefilter") if piped else ("manim",),
+              inputs={"audio": audio_path, "video": video_cfg, "output": final_out,
+                      "encode": encoder_profile(video_cfg), "thumbnails": THUMBNAILS, "piped": piped, "quality": quality if piped else None, "clip": clip},
+              progress=80, message="ترکیب ویدیو زمینه و متن (ffmpeg)..."),
+        *([Stage("thumbnails", thumbnails_stage, deps=("compose",),
+                 inputs={"interval": SPRITE_INTERVAL, "tile": SPRITE_TILE, "grid": SPRITE_GRID},
+                 progress=95, message="ساخت پوستر و تصاویر پیش‌نمایش...")] if THUMBNAILS else []),
+    ], os.path.join(job_tmp, "stages.json"), on_stage=stage_callback, stop=stop)
+
+    t0 = time.monotonic()
+    try:
+        results = graph.run(update)
+    finally:
+        if stats is not None:
+            stats["job_key"] = job_key
+            stats["stages"] = graph.timings
+            stats["total_seconds"] = round(time.monotonic() - t0, 3)
+            if encode:
+                stats["encode"] = encode
+
+    if stats is not None and results.get("thumbnails"):
+        stats["thumbnails"] = results["thumbnails"]
     update(100, "پایان کار")
-    return final_out
+    return results["compose"]
+
+
+def prefilter_video(video_path: str, work_dir: str, video_cfg: Dict[str, Any],
+                    clip: Tuple[float, float] | None = None,
+                    stop: Callable[[], bool] | None = None) -> str:
+    filter_chain = video_cfg.get("filter_chain", "")
+    if not filter_chain and not clip:
+        return video_path
+
+    out_path = os.path.join(work_dir, "base_filtered.mp4")
+    cmd = ["ffmpeg", "-y"] + _clip_args(clip) + ["-i", video_path]
+    if filter_chain:
+        cmd += ["-vf", filter_chain]
+    cmd += [
+        "-an",
+        "-c:v", "libx264",
+        "-preset", "veryfast",
+        "-crf", str(PREFILTER_CRF),
+        out_path,
+    ]
+    metrics.run(cmd, "ffmpeg_prefilter", check=True, stop=stop)
+    return out_path
+
+
+def render_overlay(meta_path: str, quality: str = "h", stop: Callable[[], bool] | None = None) -> str:
+    """Render the text overlay with the engine the Config asks for: Manim by
+    default, or fast_overlay when the text JSON has "renderer": "fast"."""
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    text_cfg = (meta.get("visual") or {}).get("text") or {}
+    if text_cfg.get("renderer") == "fast" and fast_overlay.available():
+        return run_fast_overlay(meta_path, quality=quality, stop=stop)
+    return run_manim(meta_path, quality=quality, stop=stop)
+
 
+@metrics.timed
+def run_fast_overlay(meta_path: str, quality: str = "h", output_name: str = "FarsiKinetic",
+                     stop: Callable[[], bool] | None = None) -> str:
+    work_dir = os.path.dirname(os.path.abspath(meta_path))
+    out_path = os.path.join(work_dir, f"{output_name}.mov")
+    cmd = [sys.executable, os.path.join(BASE_DIR, "fast_overlay.py"), meta_path, out_path, quality]
+    metrics.run(cmd, "fast_overlay", check=True, stop=stop, cwd=BASE_DIR)
+    return out_path
+
+
+@metrics.timed
+def run_manim(meta_path: str, quality: str = "h", output_name: str = "FarsiKinetic",
+              stop: Callable[[], bool] | None = None) -> str:
+    """Render FarsiKinetic into a media dir private to this meta file and
+    return the path of the rendered .mov next to it."""
+    work_dir = os.path.dirname(os.path.abspath(meta_path))
+    media_dir = os.path.join(work_dir, "media")
+    videos_dir = os.path.join(media_dir, "videos")
+    # a previous (failed) attempt may have left fragments or an old output
+    shutil.rmtree(videos_dir, ignore_errors=True)
 
-def run_manim(meta_path: str, quality: str = "h") -> str:
     env = os.environ.copy()
     env["FARSI_MOTION_META"] = meta_path
 
     qflag = f"-q{quality}"
-    cmd = ["manim", qflag, "-t", "motion.py", "FarsiKinetic"]
-    subprocess.run(cmd, cwd=BASE_DIR, check=True, env=env)
+    cmd = [
+        "manim", qflag, "-t",
+        "--media_dir", media_dir,
+        "-o", output_name,
+        "motion.py", "FarsiKinetic",
+    ]
+    metrics.run(cmd, "manim", check=True, stop=stop, cwd=BASE_DIR, env=env)
 
-    media_dir = os.path.join(BASE_DIR, "media", "videos", "motion")
-    for root, _, files in os.walk(media_dir):
-        for fn in files:
-            if fn.startswith("FarsiKinetic") and fn.endswith(".mov"):
-                return os.path.join(root, fn)
-    raise FileNotFoundError("خروجی Manim (FarsiKinetic.mov) پیدا نشد.")
+    rendered = None
+    for root, dirs, files in os.walk(videos_dir):
+        dirs[:] = [d for d in dirs if d != "partial_movie_files"]
+        if f"{output_name}.mov" in files:
+            rendered = os.path.join(root, f"{output_name}.mov")
+            break
+    if rendered is None:
+        raise FileNotFoundError(f"خروجی Manim ({output_name}.mov) پیدا نشد.")
 
+    out_path = os.path.join(work_dir, f"{output_name}.mov")
+    os.replace(rendered, out_path)
+    shutil.rmtree(videos_dir, ignore_errors=True)
+    return out_path
 
-def overlay_with_ffmpeg(base_video: str, overlay_video: str, audio_path: str, output_path: str, video_cfg: Dict[str, Any]):
-    filter_chain = video_cfg.get("filter_chain", "")
-    if filter_chain:
-        vf = f"[0:v]{filter_chain}[b];[b][1:v]overlay=(W-w)/2:(H-h)/2:shortest=1[v]"
+
+def _render_piece(meta: Dict[str, Any], entries: List[Dict[str, Any]], piece_dir: str,
+                  quality: str, stop: Callable[[], bool] | None = None) -> str:
+    _ensure_dir(piece_dir)
+    piece_meta_path = os.path.join(piece_dir, "meta.json")
+    with open(piece_meta_path, "w", encoding="utf-8") as f:
+        json.dump({**meta, "timeline": entries}, f, ensure_ascii=False, indent=2)
+    with stage_slot("manim"):
+        return render_overlay(piece_meta_path, quality=quality, stop=stop)
+
+
+def render_chunked(meta_path: str, quality: str = "h", max_chunks: int = MANIM_CHUNKS,
+                   use_cache: bool = SEGMENT_CACHE_ENABLED, stop: Callable[[], bool] | None = None) -> str:
+    """Split the scene timeline into time-aligned chunks, render them in
+    parallel Manim processes and losslessly concatenate the pieces."""
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    text_cfg = (meta.get("visual") or {}).get("text") or {}
+    entries = plan_timeline(meta.get("segments", []), text_cfg, meta.get("beats"))
+    work_dir = os.path.dirname(os.path.abspath(meta_path))
+    chunks_dir = os.path.join(work_dir, "chunks")
+    out_path = os.path.join(work_dir, "FarsiKinetic.mov")
+
+    if use_cache:
+        parts = _render_cached_lines(meta, entries, chunks_dir, quality, max_chunks, stop)
     else:
-        vf = "[0:v][1:v]overlay=(W-w)/2:(H-h)/2:shortest=1[v]"
+        groups = split_timeline(entries, max_chunks, MANIM_MIN_CHUNK_SECONDS)
+        if len(groups) <= 1:
+            with stage_slot("manim"):
+                return render_overlay(meta_path, quality=quality, stop=stop)
+        with ThreadPoolExecutor(max_workers=len(groups)) as pool:
+            parts = list(pool.map(
+                lambda i: _render_piece(meta, groups[i], os.path.join(chunks_dir, f"chunk_{i:03d}"), quality, stop),
+                range(len(groups)),
+            ))
+
+    concat_videos(parts, out_path)
+    shutil.rmtree(chunks_dir, ignore_errors=True)
+    return out_path
+
+
+class LinePrerenderer:
+    """Render the clip of each line into RENDER_CACHE as soon as its segment
+    is transcribed. A timeline entry only depends on the segments before
+    it, so the clips are exactly the ones render_chunked will look up. A
+    preview passes its `clip` window, which segments and beats are cut to
+    as in the meta stage.
+
+    `beats` is a future of the beat tracking running next to Whisper: a
+    line is planned (its pulses need the beats) in the render pool, which
+    waits for it, so the transcription itself never does."""
+
+    def __init__(self, visual: Dict[str, Any], beats: "Future[List[float]]", chunks_dir: str,
+                 quality: str, max_workers: int, clip: Tuple[float, float] | None = None,
+                 stop: Callable[[], bool] | None = None):
+        self.visual = visual
+        self.clip = clip
+        self.stop = stop
+        self.beats = beats
+        self.segments: List[Dict[str, Any]] = []
+        self.text_cfg = visual.get("text") or {}
+        self.chunks_dir = chunks_dir
+        self.quality = quality
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        self._futures = []
+        self._keys = set()
+        self._lock = threading.Lock()
+
+    def add(self, segment: Dict[str, Any]):
+        if self.clip:
+            clipped = clip_segments([segment], *self.clip)
+            if not clipped:
+                return
+            segment = clipped[0]
+        self.segments.append(segment)
+        self._futures.append(self._pool.submit(self._render, list(self.segments)))
+
+    def _render(self, segments: List[Dict[str, Any]]):
+        beats = self.beats.result()
+        if self.clip:
+            beats = clip_beats(beats, *self.clip)
+        entry = plan_timeline(segments, self.text_cfg, beats)[-1]
+        entry = standalone_entry(entry, fast_overlay.frame_size(self.quality)[2])
+        key = RENDER_CACHE.make_key(entry, self.visual, self.quality)
+        with self._lock:
+            if key in self._keys:
+                return
+            self._keys.add(key)
+        if RENDER_CACHE.exists(key):
+            return
+        piece_dir = os.path.join(self.chunks_dir, f"pre_{key}")
+        clip = _render_piece({"visual": self.visual}, [entry], piece_dir, self.quality, self.stop)
+        RENDER_CACHE.put(key, clip)
+        shutil.rmtree(piece_dir, ignore_errors=True)
+
+    def wait(self):
+        # a clip that failed here is simply rendered again by render_chunked
+        for future in self._futures:
+            try:
+                future.result()
+            except Exception:
+                traceback.print_exc()
+        self._pool.shutdown()
+
+
+def _video_codec(path: str) -> Tuple[str, str]:
+    """(codec, pix_fmt) of the first video stream, so that clips made here
+    can be concatenated with the renderer's output without re-encoding."""
+    out = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0",
+         "-show_entries", "stream=codec_name,pix_fmt", "-of", "csv=p=0", path],
+        capture_output=True, text=True, check=True,
+    ).stdout.strip().split(",")
+    return out[0], out[1]
+
 
+def split_lines(piece: str, entries: List[Dict[str, Any]], fps: int, out_paths: List[str]):
+    """Cut a render of standalone entries, played back to back, into one
+    clip per entry (frame ranges from timeline.line_frames), in one pass."""
+    codec, pix_fmt = _video_codec(piece)
+    n = len(entries)
+    graph = [f"[0:v]split={n}" + "".join(f"[s{i}]" for i in range(n))]
+    outputs: List[str] = []
+    first = 0
+    for i, entry in enumerate(entries):
+        last = first + line_frames(entry, fps)
+        graph.append(f"[s{i}]trim=start_frame={first}:end_frame={last},setpts=PTS-STARTPTS[o{i}]")
+        # the split loses the input rate; without -r the muxer pads to 25 fps
+        outputs += ["-map", f"[o{i}]", "-r", str(fps), "-c:v", codec, "-pix_fmt", pix_fmt, out_paths[i]]
+        first = last
+    cmd = [
+        "ffmpeg", "-y", "-nostats", "-loglevel", "error",
+        "-i", piece,
+        "-filter_complex", ";".join(graph),
+        *outputs,
+    ]
+    metrics.run(cmd, "ffmpeg_split", check=True)
+
+
+def blank_clip(frames: int, quality: str, like: str, out_path: str) -> str:
+    """A transparent clip of `frames` frames in the codec of `like`."""
+    width, height, fps = fast_overlay.frame_size(quality)
+    codec, pix_fmt = _video_codec(like)
+    cmd = [
+        "ffmpeg", "-y", "-nostats", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"color=c=black@0.0:s={width}x{height}:r={fps},format={pix_fmt}",
+        "-frames:v", str(frames),
+        "-c:v", codec, "-pix_fmt", pix_fmt,
+        out_path,
+    ]
+    metrics.run(cmd, "ffmpeg_blank", check=True)
+    return out_path
+
+
+def _render_lines(meta: Dict[str, Any], entries: List[Dict[str, Any]], piece_dir: str,
+                  quality: str, stop: Callable[[], bool] | None = None) -> List[str]:
+    """Render standalone entries back to back in one process and return one
+    clip per entry."""
+    piece = _render_piece(meta, entries, piece_dir, quality, stop)
+    if len(entries) == 1:
+        return [piece]
+    out_paths = [os.path.join(piece_dir, f"line_{i:03d}.mov") for i in range(len(entries))]
+    split_lines(piece, entries, fast_overlay.frame_size(quality)[2], out_paths)
+    return out_paths
+
+
+def _render_cached_lines(meta: Dict[str, Any], entries: List[Dict[str, Any]], chunks_dir: str,
+                         quality: str, max_workers: int,
+                         stop: Callable[[], bool] | None = None) -> List[str]:
+    """One clip per timeline entry, rendered without its lead-in, plus a
+    blank clip for every lead-in. Clips already in RENDER_CACHE are reused;
+    the distinct missing ones are rendered in at most `max_workers` chunk
+    renders (like render_chunked without the cache) and split per line."""
+    visual = meta.get("visual") or {}
+    fps = fast_overlay.frame_size(quality)[2]
+    lines = [standalone_entry(entry, fps) for entry in entries]
+    keys = [RENDER_CACHE.make_key(line, visual, quality) for line in lines]
+
+    missing: Dict[str, Dict[str, Any]] = {}
+    for key, line in dict(zip(keys, lines)).items():
+        if not RENDER_CACHE.contains(key):
+            missing[key] = line
+
+    key_of = {id(line): key for key, line in missing.items()}
+    groups = split_timeline(list(missing.values()), max_workers, MANIM_MIN_CHUNK_SECONDS)
+
+    def render(i: int) -> Dict[str, str]:
+        clips = _render_lines(meta, groups[i], os.path.join(chunks_dir, f"chunk_{i:03d}"), quality, stop)
+        rendered = {}
+        for line, clip in zip(groups[i], clips):
+            RENDER_CACHE.put(key_of[id(line)], clip)
+            rendered[key_of[id(line)]] = clip
+        return rendered
+
+    fresh: Dict[str, str] = {}
+    if groups:
+        with ThreadPoolExecutor(max_workers=len(groups)) as pool:
+            for rendered in pool.map(render, range(len(groups))):
+                fresh.update(rendered)
+
+    _ensure_dir(chunks_dir)
+    clips = []
+    for i, key in enumerate(keys):
+        clip = RENDER_CACHE.checkout(key, os.path.join(chunks_dir, f"part_{i:04d}.mov"))
+        if clip is None:
+            # evicted between render and concat: use the freshly rendered file
+            clip = fresh.get(key) or _render_piece(
+                meta, [lines[i]], os.path.join(chunks_dir, f"retry_{i:04d}"), quality, stop
+            )
+        clips.append(clip)
+
+    # each gap ends where the line starts in a render without the cache, so
+    # the frames snapped pulses add or drop never pile up along the song
+    blanks: Dict[int, str] = {}
+    parts = []
+    target = cursor = 0
+    for entry, line, clip in zip(entries, lines, clips):
+        target += frame_count(entry["wait"], fps)
+        gap = max(0, target - cursor)
+        target += line_frames(entry, fps)
+        cursor += gap + line_frames(line, fps)
+        if gap:
+            if gap not in blanks:
+                blanks[gap] = blank_clip(gap, quality, clip, os.path.join(chunks_dir, f"gap_{gap:06d}.mov"))
+            parts.append(blanks[gap])
+        parts.append(clip)
+    return parts
+
+
+def concat_videos(parts: List[str], output_path: str):
+    list_path = output_path + ".txt"
+    with open(list_path, "w", encoding="utf-8") as f:
+        for part in parts:
+            escaped = part.replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
     cmd = [
         "ffmpeg", "-y",
-        "-i", base_video,
+        "-f", "concat",
+        "-safe", "0",
+        "-i", list_path,
+        "-c", "copy",
+        output_path,
+    ]
+    try:
+        metrics.run(cmd, "ffmpeg_concat", check=True)
+    finally:
+        os.remove(list_path)
+
+
+def encoder_profile(video_cfg: Dict[str, Any]) -> Dict[str, Any]:
+    name = video_cfg.get("encoder") or DEFAULT_ENCODER_PROFILE
+    if name not in ENCODER_PROFILES:
+        name = "standard"
+    profile = {"name": name, **ENCODER_PROFILES[name]}
+    for key in ("preset", "crf", "tune", "threads"):
+        if key in video_cfg:
+            profile[key] = video_cfg[key]
+    layout = video_cfg.get("mp4_layout") or DEFAULT_MP4_LAYOUT
+    profile["layout"] = layout if layout in MP4_LAYOUTS else "faststart"
+    return profile
+
+
+def encoder_args(profile: Dict[str, Any]) -> List[str]:
+    args = ["-c:v", "libx264", "-preset", str(profile["preset"]), "-crf", str(profile["crf"])]
+    if profile.get("tune"):
+        args += ["-tune", str(profile["tune"])]
+    if profile.get("threads") is not None:
+        args += ["-threads", str(profile["threads"])]
+    return args + MP4_LAYOUTS[profile.get("layout") or "faststart"]
+
+
+def _clip_args(clip: Tuple[float, float] | None) -> List[str]:
+    """Input options that seek to a preview window."""
+    if not clip:
+        return []
+    return ["-ss", f"{clip[0]:.3f}", "-t", f"{clip[1] - clip[0]:.3f}"]
+
+
+def _overlay_filter(filter_chain: str) -> str:
+    if filter_chain:
+        return f"[0:v]{filter_chain}[b];[b][1:v]overlay=(W-w)/2:(H-h)/2:shortest=1[v]"
+    return "[0:v][1:v]overlay=(W-w)/2:(H-h)/2:shortest=1[v]"
+
+
+def thumbnail_paths(video_path: str) -> Dict[str, str]:
+    base = os.path.splitext(video_path)[0]
+    return {
+        "poster": f"{base}.jpg",
+        "sprite": f"{base}_sprite_%03d.jpg",
+        "index": f"{base}_thumbs.json",
+    }
+
+
+def _thumbnail_filter(src: str) -> str:
+    """Split `src` into [vout] for the encode plus a poster and sprite sheets."""
+    tile_w, tile_h = SPRITE_TILE
+    cols, rows = SPRITE_GRID
+    return (
+        f"[{src}]split=3[vout][tp][ts];"
+        f"[tp]thumbnail=n=50,scale={POSTER_WIDTH}:-2[poster];"
+        f"[ts]fps=1/{SPRITE_INTERVAL},"
+        f"scale={tile_w}:{tile_h}:force_original_aspect_ratio=decrease,"
+        f"pad={tile_w}:{tile_h}:(ow-iw)/2:(oh-ih)/2,tile={cols}x{rows}[sprite]"
+    )
+
+
+def _thumbnail_outputs(video_path: str) -> List[str]:
+    paths = thumbnail_paths(video_path)
+    for old in glob.glob(paths["sprite"].replace("%03d", "[0-9][0-9][0-9]")):
+        os.remove(old)
+    return [
+        "-map", "[poster]", "-frames:v", "1", "-q:v", "3", paths["poster"],
+        "-map", "[sprite]", "-q:v", "5", paths["sprite"],
+    ]
+
+
+def _mp4_duration(path: str) -> float | None:
+    """Duration from the mvhd box; None for a fragmented file's empty moov."""
+    try:
+        with open(path, "rb") as f:
+            end = os.fstat(f.fileno()).st_size
+            in_moov = False
+            while f.tell() + 8 <= end:
+                start = f.tell()
+                size, kind = struct.unpack(">I4s", f.read(8))
+                if size == 1:
+                    size = struct.unpack(">Q", f.read(8))[0]
+                elif size == 0:
+                    size = end - start
+                if kind == b"moov" and not in_moov:
+                    in_moov, end = True, start + size
+                    continue
+                if in_moov and kind == b"mvhd":
+                    version = f.read(4)[0]
+                    if version == 1:
+                        f.seek(16, 1)
+                        timescale, duration = struct.unpack(">IQ", f.read(12))
+                    else:
+                        f.seek(8, 1)
+                        timescale, duration = struct.unpack(">II", f.read(8))
+                    return duration / timescale if timescale and duration else None
+                if size < 8:
+                    return None
+                f.seek(start + size)
+    except (OSError, struct.error, IndexError):
+        pass
+    return None
+
+
+def _probe_duration(video_path: str) -> float | None:
+    try:
+        out = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=noprint_wrappers=1:nokey=1", video_path],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        return float(out.strip())
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        return None
+
+
+def extract_thumbnails(video_path: str):
+    """Poster and sprite sheets of an existing video, for renders whose
+    encode pass did not make them (resumed from an older run)."""
+    cmd = [
+        "ffmpeg", "-y", "-nostats", "-loglevel", "error",
+        "-i", video_path,
+        "-filter_complex", _thumbnail_filter("0:v"),
+        "-map", "[vout]", "-f", "null", "-",
+        *_thumbnail_outputs(video_path),
+    ]
+    metrics.run(cmd, "ffmpeg_thumbnails", check=True)
+
+
+def write_thumbnail_index(video_path: str) -> str:
+    """Describe the poster and sprite sheets of a render in <base>_thumbs.json."""
+    paths = thumbnail_paths(video_path)
+    sheets = sorted(glob.glob(paths["sprite"].replace("%03d", "[0-9][0-9][0-9]")))
+    if not os.path.exists(paths["poster"]) or not sheets:
+        extract_thumbnails(video_path)
+        sheets = sorted(glob.glob(paths["sprite"].replace("%03d", "[0-9][0-9][0-9]")))
+    duration = _mp4_duration(video_path) or _probe_duration(video_path)
+    index = {
+        "poster": paths["poster"],
+        "sheets": sheets,
+        "interval": SPRITE_INTERVAL,
+        "tile": list(SPRITE_TILE),
+        "grid": list(SPRITE_GRID),
+        "duration": round(duration, 3) if duration else None,
+    }
+    with open(paths["index"], "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    return paths["index"]
+
+
+def _run_encoder(cmd: List[str], frames=None, tool: str = "ffmpeg_compose",
+                 stop: Callable[[], bool] | None = None) -> Dict[str, Any]:
+    """Run an ffmpeg command ending in `-progress pipe:1`, feeding `frames`
+    (raw video buffers) to its stdin, and return the measured throughput."""
+    progress: Dict[str, str] = {}
+    t0 = time.monotonic()
+    proc = subprocess.Popen(
+        cmd,
+        stdin=subprocess.PIPE if frames is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+    )
+
+    def read_progress():
+        for raw in proc.stdout:
+            key, _, value = raw.decode("utf-8", "replace").strip().partition("=")
+            if key:
+                progress[key] = value
+
+    reader = threading.Thread(target=read_progress, daemon=True)
+    reader.start()
+    try:
+        if frames is not None:
+            try:
+                for frame in frames:
+                    if stop is not None and stop():
+                        # closing stdin would let ffmpeg finish a short file
+                        raise JobCancelled()
+                    proc.stdin.write(frame)
+            except BrokenPipeError:
+                # ffmpeg stopped reading: -shortest reached the end of the
+                # base video, or it failed and its exit code says so
+                pass
+            finally:
+                try:
+                    proc.stdin.close()
+                except BrokenPipeError:
+                    pass
+        metrics.wait(proc, tool, stop)
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        raise
+    finally:
+        reader.join(timeout=5)
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+    seconds = time.monotonic() - t0
+    try:
+        frame_count = int(progress.get("frame", "0"))
+    except ValueError:
+        frame_count = 0
+    return {
+        "frames": frame_count,
+        "seconds": round(seconds, 3),
+        "fps": round(frame_count / seconds, 1) if seconds > 0 else 0.0,
+        "speed": progress.get("speed", "").strip().rstrip("x") or None,
+    }
+
+
+def _compose_graph(video_cfg: Dict[str, Any], output_path: str, thumbnails: bool) -> Tuple[List[str], List[str]]:
+    """-filter_complex/-map arguments of the composite and the extra outputs."""
+    graph = _overlay_filter(video_cfg.get("filter_chain", ""))
+    if not thumbnails:
+        return ["-filter_complex", graph, "-map", "[v]"], []
+    return (
+        ["-filter_complex", f"{graph};{_thumbnail_filter('v')}", "-map", "[vout]"],
+        _thumbnail_outputs(output_path),
+    )
+
+
+@metrics.timed
+def overlay_with_ffmpeg(base_video: str, overlay_video: str, audio_path: str, output_path: str,
+                        video_cfg: Dict[str, Any], clip: Tuple[float, float] | None = None,
+                        thumbnails: bool = False, clip_base: bool = False,
+                        stop: Callable[[], bool] | None = None) -> Dict[str, Any]:
+    """Composite overlay_video over base_video with the audio. The clip
+    window always applies to the audio; with clip_base also to base_video
+    (which has not been cut by a prefilter pass then)."""
+    profile = encoder_profile(video_cfg)
+    graph, extra_outputs = _compose_graph(video_cfg, output_path, thumbnails)
+    cmd = [
+        "ffmpeg", "-y", "-nostats", "-loglevel", "error",
+        *(_clip_args(clip) if clip_base else []), "-i", base_video,
         "-i", overlay_video,
-        "-i", audio_path,
-        "-filter_complex", vf,
-        "-map", "[v]",
+        *_clip_args(clip), "-i", audio_path,
+        *graph,
         "-map", "2:a",
-        "-c:v", "libx264",
+        *encoder_args(profile),
+        "-c:a", "aac",
+        "-shortest",
+        "-progress", "pipe:1",
+        output_path,
+        *extra_outputs,
+    ]
+    return {"mode": "file", "profile": profile, **_run_encoder(cmd, stop=stop)}
+
+
+@metrics.timed
+def overlay_piped(base_video: str, meta_path: str, audio_path: str, output_path: str,
+                  video_cfg: Dict[str, Any], quality: str = "h",
+                  clip: Tuple[float, float] | None = None,
+                  thumbnails: bool = False, stop: Callable[[], bool] | None = None) -> Dict[str, Any]:
+    """Composite the fast overlay straight from memory: its frames go to
+    ffmpeg's stdin, so no intermediate .mov is written or read back."""
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    profile = encoder_profile(video_cfg)
+    graph, extra_outputs = _compose_graph(video_cfg, output_path, thumbnails)
+    cmd = [
+        "ffmpeg", "-y", "-nostats", "-loglevel", "error",
+        "-i", base_video,
+        *fast_overlay.rawvideo_input(quality, "pipe:0"),
+        *_clip_args(clip), "-i", audio_path,
+        *graph,
+        "-map", "2:a",
+        *encoder_args(profile),
         "-c:a", "aac",
         "-shortest",
+        "-progress", "pipe:1",
         output_path,
+        *extra_outputs,
     ]
-    subprocess.run(cmd, check=True)
+    return {"mode": "pipe", "profile": profile, **_run_encoder(cmd, fast_overlay.iter_frames(meta, quality), stop=stop)}
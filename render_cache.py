@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache of rendered per-line overlay clips.
+
+A clip is one line on its own, without the lead-in before it (the
+pipeline joins the clips with blank gaps) and with its beat pulses relative
+to the clip. It is keyed by everything that changes its pixels: the text,
+pulse/hold timing, font and colors, the text config, the render quality
+(fps + resolution) and the scene source itself. Repeated chorus lines, and
+re-renders with a Config already used, reuse the clip.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from typing import Any, Dict, Optional
+
+from disk_cache import DiskCache
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SEGMENT_CACHE_ENABLED = os.environ.get("SEGMENT_CACHE", "1") != "0"
+SEGMENT_CACHE_DIR = os.environ.get(
+    "SEGMENT_CACHE_DIR", os.path.join(BASE_DIR, "cache", "segments")
+)
+SEGMENT_CACHE_MAX_BYTES = int(os.environ.get("SEGMENT_CACHE_MAX_MB", "4096")) * 1024 * 1024
+
+# keys that place an entry on the song timeline but do not change its pixels
+_POSITIONAL_KEYS = ("clock", "start", "end", "duration", "wait")
+_SCENE_SOURCES = ("motion.py", "timeline.py", "fast_overlay.py")
+
+
+def _scene_version() -> str:
+    h = hashlib.sha256()
+    for name in _SCENE_SOURCES:
+        with open(os.path.join(BASE_DIR, name), "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+class RenderCache(DiskCache):
+    suffix = ".mov"
+
+    def __init__(self, root: str, max_bytes: int):
+        super().__init__(root, max_bytes)
+        self._version: Optional[str] = None
+
+    def make_key(self, entry: Dict[str, Any], visual: Dict[str, Any], quality: str) -> str:
+        if self._version is None:
+            self._version = _scene_version()
+        payload = json.dumps({
+            "entry": {k: v for k, v in entry.items() if k not in _POSITIONAL_KEYS},
+            "font_name": visual.get("font_name"),
+            "primary_color": visual.get("primary_color"),
+            "accent_color": visual.get("accent_color"),
+            "text": visual.get("text") or {},
+            "quality": quality,
+            "scene": self._version,
+        }, sort_keys=True, ensure_ascii=False)
+        return f"clip_{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+    def contains(self, key: str) -> bool:
+        found = self.exists(key)
+        self._count(hit=found)
+        return found
+
+    def checkout(self, key: str, dest_path: str) -> Optional[str]:
+        """Hardlink (or copy) a cached clip to dest_path so that a concurrent
+        eviction cannot pull it away while it is being concatenated."""
+        path = self._path(key)
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        try:
+            os.link(path, dest_path)
+        except FileNotFoundError:
+            return None
+        except OSError:
+            try:
+                shutil.copyfile(path, dest_path)
+            except FileNotFoundError:
+                return None
+        self._touch(path)
+        return dest_path
+
+    def put(self, key: str, src_path: str):
+        dest = self._path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=self.suffix, dir=os.path.dirname(dest))
+        os.close(fd)
+        try:
+            shutil.copyfile(src_path, tmp_path)
+            os.replace(tmp_path, dest)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+
+
+RENDER_CACHE = RenderCache(SEGMENT_CACHE_DIR, SEGMENT_CACHE_MAX_BYTES)
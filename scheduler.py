@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Job scheduler: a pool of worker threads that claim jobs from the durable
+queue in job_queue (priorities, fair share between projects) plus
+per-stage concurrency limits.
+
+Workers are threads because the expensive stages (Manim, ffmpeg) run as
+subprocesses and Whisper/librosa spend their time in native code, so the
+GIL is not the bottleneck; the stage limits are what keep the box from
+being oversubscribed.
+"""
+
+import os
+import time
+import threading
+import contextlib
+import traceback
+from typing import Callable, Dict, List
+
+import job_queue
+import metrics
+
+WORKER_COUNT = int(os.environ.get("WORKER_COUNT", str(max(1, (os.cpu_count() or 2) // 2))))
+POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", "5"))
+DEFAULT_STAGE_LIMITS = {
+    "whisper": 1,
+    "beats": 2,
+    "manim": max(1, (os.cpu_count() or 2) // 2),
+    "ffmpeg": 4,
+}
+
+
+def _parse_limits(raw: str) -> Dict[str, int]:
+    limits = {}
+    for part in raw.split(","):
+        if "=" not in part:
+            continue
+        name, value = part.split("=", 1)
+        try:
+            limits[name.strip()] = max(1, int(value))
+        except ValueError:
+            continue
+    return limits
+
+
+class _Timings:
+    def __init__(self, keep: int = 500):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent: List[float] = []
+        self.keep = keep
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.recent.append(value)
+        if len(self.recent) > self.keep:
+            del self.recent[0]
+
+    def to_dict(self) -> Dict[str, float]:
+        recent = sorted(self.recent)
+        p95 = recent[int(0.95 * (len(recent) - 1))] if recent else 0.0
+        return {
+            "count": self.count,
+            "avg": (self.total / self.count) if self.count else 0.0,
+            "max": self.max,
+            "p95": p95,
+        }
+
+
+class StageLimiter:
+    def __init__(self, limits: Dict[str, int]):
+        self.limits = dict(limits)
+        self._semaphores = {name: threading.BoundedSemaphore(n) for name, n in self.limits.items()}
+        self._lock = threading.Lock()
+        self._wait: Dict[str, _Timings] = {}
+        self._run: Dict[str, _Timings] = {}
+        self._active: Dict[str, int] = {}
+
+    def _record(self, table: Dict[str, _Timings], name: str, value: float):
+        with self._lock:
+            table.setdefault(name, _Timings()).add(value)
+
+    @contextlib.contextmanager
+    def slot(self, name: str):
+        sem = self._semaphores.get(name)
+        t0 = time.monotonic()
+        if sem is not None:
+            sem.acquire()
+        t1 = time.monotonic()
+        self._record(self._wait, name, t1 - t0)
+        metrics.SLOT_WAIT_SECONDS.observe(t1 - t0, slot=name)
+        with self._lock:
+            self._active[name] = self._active.get(name, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active[name] -= 1
+            self._record(self._run, name, time.monotonic() - t1)
+            if sem is not None:
+                sem.release()
+
+    def stats(self) -> Dict[str, Dict]:
+        with self._lock:
+            names = set(self.limits) | set(self._wait)
+            return {
+                name: {
+                    "limit": self.limits.get(name),
+                    "active": self._active.get(name, 0),
+                    "wait": self._wait[name].to_dict() if name in self._wait else None,
+                    "run": self._run[name].to_dict() if name in self._run else None,
+                }
+                for name in sorted(names)
+            }
+
+
+STAGE_LIMITER = StageLimiter({
+    **DEFAULT_STAGE_LIMITS,
+    **_parse_limits(os.environ.get("STAGE_LIMITS", "")),
+})
+
+
+def stage_slot(name: str):
+    return STAGE_LIMITER.slot(name)
+
+
+class JobScheduler:
+    def __init__(self, run_job: Callable[[int], None], num_workers: int = WORKER_COUNT,
+                 poll_interval: float = POLL_SECONDS):
+        self.run_job = run_job
+        self.num_workers = max(1, num_workers)
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+        self._running: Dict[int, int] = {}
+        self._last_served: Dict[int, float] = {}
+        self._threads: List[threading.Thread] = []
+        self._wait = _Timings()
+        self._run = _Timings()
+
+    def notify(self):
+        with self._cond:
+            self._cond.notify()
+
+    def _heartbeat_loop(self, job_id: int, worker_id: str, stop: threading.Event):
+        while not stop.wait(job_queue.LEASE_SECONDS / 3):
+            try:
+                job_queue.heartbeat(job_id, worker_id)
+            except Exception:
+                traceback.print_exc()
+
+    def _claim(self, worker_id: str):
+        with self._cond:
+            last_served = dict(self._last_served)
+        try:
+            return job_queue.claim_next_job(worker_id, last_served)
+        except Exception:
+            traceback.print_exc()
+            return None
+
+    def _worker(self, index: int):
+        worker_id = job_queue.make_worker_id(index)
+        while True:
+            job = self._claim(worker_id)
+            if job is None:
+                with self._cond:
+                    self._cond.wait(self.poll_interval)
+                continue
+
+            project_id = job.project_id
+            with self._cond:
+                self._running[project_id] = self._running.get(project_id, 0) + 1
+                self._last_served[project_id] = time.monotonic()
+                # started_at moves on every re-claim, so only a first claim
+                # measures the time since the job was enqueued
+                if job.created_at and job.started_at and (job.attempts or 0) <= 1:
+                    waited = (job.started_at - job.created_at).total_seconds()
+                    self._wait.add(waited)
+                    metrics.QUEUE_WAIT_SECONDS.observe(waited, job_type=job.job_type or "standard")
+
+            stop = threading.Event()
+            beat = threading.Thread(
+                target=self._heartbeat_loop, args=(job.id, worker_id, stop), daemon=True
+            )
+            beat.start()
+            started = time.monotonic()
+            try:
+                self.run_job(job.id)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                stop.set()
+                try:
+                    job_queue.release(job.id, worker_id)
+                except Exception:
+                    traceback.print_exc()
+                ran = time.monotonic() - started
+                metrics.JOB_RUN_SECONDS.observe(ran, job_type=job.job_type or "standard")
+                with self._cond:
+                    self._run.add(ran)
+                    self._running[project_id] -= 1
+                    if not self._running[project_id]:
+                        del self._running[project_id]
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.num_workers):
+            t = threading.Thread(target=self._worker, args=(i,), name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            running = sum(self._running.values())
+            wait = self._wait.to_dict()
+            run = self._run.to_dict()
+        return {
+            "workers": self.num_workers,
+            "queued": job_queue.queued_count(),
+            "running": running,
+            "queue_wait": wait,
+            "run_time": run,
+            "stages": STAGE_LIMITER.stats(),
+        }
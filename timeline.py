@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Timing plan of the FarsiKinetic scene, without importing Manim.
+
+Every entry carries the wait before the line and the length of the line's
+animations, plus `clock`, the scene time at which the line appears. The
+pipeline uses it to cut the song into chunks that render independently
+and concatenate back to exactly the same video.
+
+Between fade-in and fade-out a line stays on screen for `body` seconds and
+pulses at `pulse_times` (relative to the start of the body): the tracked
+beats that fall inside it, or a fixed run of pulses when there are none.
+"""
+
+import math
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional
+
+FADE_IN = 0.5
+FADE_OUT = 0.5
+SAMPLE_SEGMENTS = [{"start": 0.0, "end": 4.0, "text": "نمونه موشن فارسی"}]
+
+
+def _beat_pulses(beats: List[float], body_start: float, body: float, pulse_rt: float) -> List[float]:
+    times: List[float] = []
+    i = bisect_left(beats, body_start)
+    while i < len(beats) and beats[i] + pulse_rt <= body_start + body:
+        t = beats[i] - body_start
+        if not times or t - times[-1] >= pulse_rt:
+            times.append(round(t, 3))
+        i += 1
+    return times
+
+
+def plan_timeline(segments: List[Dict[str, Any]], text_cfg: Dict[str, Any],
+                  beats: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+    pulse_rt = text_cfg.get("pulse_rt", 0.09)
+    segments = segments or SAMPLE_SEGMENTS
+    beats = sorted(float(b) for b in beats) if beats else []
+
+    entries: List[Dict[str, Any]] = []
+    current_time = 0.0  # song time of the previous line's end
+    clock = 0.0         # scene time actually elapsed
+    for seg in segments:
+        start = float(seg.get("start", 0.0))
+        end = float(seg.get("end", start + 3.0))
+        duration = max(0.5, end - start)
+        text = seg.get("text", "").strip() or "..."
+
+        gap = max(0.0, start - current_time)
+        current_time += gap
+
+        pulses = max(1, int(duration / max(pulse_rt, 0.4)))
+        body = pulses * pulse_rt + max(0.2, duration - pulses * pulse_rt)
+        length = FADE_IN + body + FADE_OUT
+        if beats:
+            # the overlay plays from the start of the song, so scene time is
+            # song time and the beats can be used as they are
+            pulse_times = _beat_pulses(beats, clock + gap + FADE_IN, body, pulse_rt)
+        else:
+            pulse_times = [round(i * pulse_rt, 3) for i in range(pulses)]
+
+        entries.append({
+            "text": text,
+            "start": start,
+            "end": end,
+            "duration": duration,
+            "wait": gap,
+            "clock": clock + gap,
+            "pulse_rt": pulse_rt,
+            "pulse_times": pulse_times,
+            "body": body,
+            "length": length,
+        })
+        clock += gap + length
+        current_time = end
+    return entries
+
+
+def pulse_span(entry: Dict[str, Any]) -> float:
+    """Body time until the last pulse ends; the rest of the body is static."""
+    times = entry["pulse_times"]
+    return min(entry["body"], times[-1] + entry["pulse_rt"]) if times else 0.0
+
+
+def pulse_phase(entry: Dict[str, Any], t: float) -> Optional[float]:
+    """Progress (0..1) of the pulse running at body time t, None between pulses."""
+    times = entry["pulse_times"]
+    i = bisect_left(times, t + 1e-9) - 1
+    if i >= 0 and t < times[i] + entry["pulse_rt"]:
+        return (t - times[i]) / entry["pulse_rt"]
+    return None
+
+
+def frame_count(run_time: float, fps: int) -> int:
+    # Manim renders ceil(run_time * fps) frames per animation/wait
+    return int(math.ceil(run_time * fps - 1e-9)) if run_time > 0 else 0
+
+
+def line_frames(entry: Dict[str, Any], fps: int) -> int:
+    """Frames of a line without its lead-in: fade in, pulses, hold, fade out."""
+    active = pulse_span(entry)
+    return (frame_count(FADE_IN, fps) + frame_count(active, fps)
+            + frame_count(entry["body"] - active, fps) + frame_count(FADE_OUT, fps))
+
+
+def standalone_entry(entry: Dict[str, Any], fps: int) -> Dict[str, Any]:
+    """The entry as a clip of its own: no lead-in (the gap is added when the
+    clips are joined) and pulses snapped to the frame grid, so a line sung
+    again later in the song, on its own beats, renders the same frames."""
+    return {
+        **entry,
+        "wait": 0.0,
+        "pulse_times": sorted({round(round(t * fps) / fps, 3) for t in entry["pulse_times"]}),
+    }
+
+
+def clip_segments(segments: List[Dict[str, Any]], start: float, end: float) -> List[Dict[str, Any]]:
+    """Segments overlapping [start, end], cut to it and shifted to start at 0."""
+    clipped = []
+    for seg in segments:
+        s = max(float(seg.get("start", 0.0)), start)
+        e = min(float(seg.get("end", s + 3.0)), end)
+        if e <= s:
+            continue
+        clipped.append({**seg, "start": s - start, "end": e - start})
+    return clipped
+
+
+def clip_beats(beats: List[float], start: float, end: float) -> List[float]:
+    """Beats inside [start, end), shifted like clip_segments."""
+    return [b - start for b in beats if start <= b < end]
+
+
+def timeline_span(entries: List[Dict[str, Any]]) -> float:
+    return sum(e["wait"] + e["length"] for e in entries)
+
+
+def split_timeline(entries: List[Dict[str, Any]], max_chunks: int,
+                   min_seconds: float = 0.0) -> List[List[Dict[str, Any]]]:
+    """Split into at most `max_chunks` contiguous groups of roughly equal
+    scene time, none shorter than `min_seconds` (except a lone group)."""
+    total = timeline_span(entries)
+    if max_chunks <= 1 or len(entries) <= 1 or total <= 0:
+        return [entries] if entries else []
+    n = max_chunks
+    if min_seconds > 0:
+        n = max(1, min(n, int(total // min_seconds)))
+    n = min(n, len(entries))
+    target = total / n
+
+    groups: List[List[Dict[str, Any]]] = [[]]
+    acc = 0.0
+    for e in entries:
+        span = e["wait"] + e["length"]
+        if groups[-1] and acc + span / 2 > target * len(groups) and len(groups) < n:
+            groups.append([])
+        groups[-1].append(e)
+        acc += span
+    return groups
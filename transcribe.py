@@ -3,46 +3,228 @@
 
 import os
 import json
-from typing import Tuple, List, Dict, Any
+import threading
+import contextlib
+from typing import Callable, Iterator, Tuple, List, Dict, Any
+
+from analysis_cache import ANALYSIS_CACHE
+import whisper_pool
+import metrics
 
 try:
+    import numpy as np
     import whisper
 except Exception:
+    np = None
     whisper = None
 
+# energy VAD: only stretches with sound are decoded, silences longer than
+# VAD_MIN_SILENCE seconds are cut out and the timestamps shifted back
+WHISPER_VAD = os.environ.get("WHISPER_VAD", "1") != "0"
+VAD_MIN_SILENCE = float(os.environ.get("VAD_MIN_SILENCE", "2.0"))
+VAD_FRAME_SECONDS = 0.03
+VAD_PAD_SECONDS = 0.3
+SAMPLE_RATE = 16000
+# pieces are decoded (and their segments yielded) one Whisper window at a time
+STREAM_WINDOW_SECONDS = 30.0
+
+DEFAULT_LANGUAGE = "fa"
+
+# cache key -> [lock, callers holding or waiting for it]
+_inflight: Dict[str, list] = {}
+_inflight_lock = threading.Lock()
+
+
+def _write_segments(out_json: str, segments: list):
+    with open(out_json, "w", encoding="utf-8") as f:
+        json.dump({"segments": segments}, f, ensure_ascii=False, indent=2)
+
 
-def transcribe_audio(audio_path: str, cache_dir: str, model_name: str = "small") -> Tuple[list, str]:
+@metrics.timed
+def transcribe_audio(audio_path: str, cache_dir: str, model_name: str = "small",
+                     language: str = "fa", word_timestamps: bool = False,
+                     on_segment: Callable[[Dict[str, Any]], None] | None = None,
+                     until: float | None = None) -> Tuple[list, str]:
+    """Transcribe into <cache_dir>/segments_<name>.json. `on_segment` sees
+    every segment as soon as it is available, before the track is done.
+    With `until` (a preview), decoding stops at the first segment starting
+    at or after it; such a partial track is not put in the shared cache.
+
+    The file is written for inspection only and never read back: reuse is
+    the analysis cache's (keyed by model, language and words) and the
+    stage graph's (keyed by the stage inputs) job."""
     os.makedirs(cache_dir, exist_ok=True)
     base = os.path.splitext(os.path.basename(audio_path))[0]
     out_json = os.path.join(cache_dir, f"segments_{base}.json")
 
-    if os.path.exists(out_json):
-        with open(out_json, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return data["segments"], out_json
-
     if whisper is None:
         segments = [{
             "start": 0.0,
             "end": 5.0,
             "text": "برای استفاده از whisper آن را نصب کنید."
         }]
-        with open(out_json, "w", encoding="utf-8") as f:
-            json.dump({"segments": segments}, f, ensure_ascii=False, indent=2)
-        return segments, out_json
+        if on_segment:
+            for seg in segments:
+                on_segment(seg)
+    else:
+        segments = []
+        stream = iter_transcription(audio_path, model_name, language, word_timestamps)
+        # closing the stream early leaves the analysis cache alone
+        with contextlib.closing(stream):
+            for seg in stream:
+                if until is not None and seg["start"] >= until:
+                    break
+                segments.append(seg)
+                if on_segment:
+                    on_segment(seg)
+    _write_segments(out_json, segments)
+    return segments, out_json
 
-    model = whisper.load_model(model_name)
-    result = model.transcribe(audio_path, language="fa")
 
-    segments: List[Dict[str, Any]] = []
-    for seg in result.get("segments", []):
-        segments.append({
-            "start": float(seg.get("start", 0.0)),
-            "end": float(seg.get("end", 0.0)),
-            "text": seg.get("text", "").strip(),
-        })
+def options_for(text_cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """language/word_timestamps asked for by a Config's text JSON. Both the
+    job's transcribe stage and the background batcher pass these, so they
+    meet on the same cache key."""
+    return {
+        "language": text_cfg.get("language") or DEFAULT_LANGUAGE,
+        "word_timestamps": bool(text_cfg.get("word_timestamps")),
+    }
 
-    with open(out_json, "w", encoding="utf-8") as f:
-        json.dump({"segments": segments}, f, ensure_ascii=False, indent=2)
 
-    return segments, out_json
+def _cache_key(audio_path: str, model_name: str, language: str, word_timestamps: bool = False) -> str:
+    return ANALYSIS_CACHE.make_key("segments", audio_path, {
+        "model": model_name,
+        "language": language,
+        "vad": VAD_MIN_SILENCE if WHISPER_VAD else None,
+        "words": word_timestamps,
+    })
+
+
+def is_cached(audio_path: str, model_name: str = "small", language: str = "fa",
+              word_timestamps: bool = False) -> bool:
+    return ANALYSIS_CACHE.exists(_cache_key(audio_path, model_name, language, word_timestamps))
+
+
+def iter_transcription(audio_path: str, model_name: str = "small", language: str = "fa",
+                       word_timestamps: bool = False) -> Iterator[Dict[str, Any]]:
+    """Yield segments (with "words" when word_timestamps is set) as soon as
+    each stretch of audio is decoded. A track in the shared analysis cache
+    is served from there; a decoded one is cached once it is complete.
+    Concurrent calls for the same track wait for one another instead of
+    transcribing it twice."""
+    cache_key = _cache_key(audio_path, model_name, language, word_timestamps)
+    with _inflight_lock:
+        entry = _inflight.setdefault(cache_key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            cached = ANALYSIS_CACHE.get(cache_key)
+            if cached is not None:
+                yield from cached["segments"]
+                return
+            segments = []
+            for seg in _decode(audio_path, model_name, language, word_timestamps):
+                segments.append(seg)
+                yield seg
+            ANALYSIS_CACHE.put(cache_key, {"segments": segments})
+    finally:
+        # the entry goes with its last caller; dropping it while another
+        # caller still waits on its lock would let a third one start a
+        # second transcription next to that one
+        with _inflight_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _inflight[cache_key]
+
+
+def transcribe_cached(audio_path: str, model_name: str = "small", language: str = "fa",
+                      word_timestamps: bool = False) -> List[Dict[str, Any]]:
+    return list(iter_transcription(audio_path, model_name, language, word_timestamps))
+
+
+def speech_regions(audio, sr: int = SAMPLE_RATE,
+                   min_silence: float = VAD_MIN_SILENCE) -> List[Tuple[int, int]]:
+    """(start, end) sample ranges with sound, split at silences of at least
+    min_silence seconds. Silence is an RMS 30 dB under the loud frames."""
+    frame = int(VAD_FRAME_SECONDS * sr)
+    n = len(audio) // frame
+    if n == 0:
+        return [(0, len(audio))] if len(audio) else []
+    rms = np.sqrt((audio[:n * frame].reshape(n, frame) ** 2).mean(axis=1) + 1e-12)
+    db = 20 * np.log10(rms)
+    voiced = db > max(np.percentile(db, 95) - 30.0, -60.0)
+
+    regions: List[Tuple[int, int]] = []
+    gap_frames = int(min_silence / VAD_FRAME_SECONDS)
+    pad = int(VAD_PAD_SECONDS * sr)
+    start = None
+    last = -gap_frames
+    for i, v in enumerate(voiced):
+        if not v:
+            continue
+        if start is None:
+            start = i
+        elif i - last > gap_frames:
+            regions.append((start, last + 1))
+            start = i
+        last = i
+    if start is not None:
+        regions.append((start, last + 1))
+    return [(max(0, s * frame - pad), min(len(audio), e * frame + pad)) for s, e in regions]
+
+
+def split_long(audio, regions: List[Tuple[int, int]], sr: int = SAMPLE_RATE,
+               max_seconds: float = STREAM_WINDOW_SECONDS) -> List[Tuple[int, int]]:
+    """Cut regions longer than max_seconds at the quietest 30 ms frame of
+    each window's last quarter, so every piece decodes (and streams) on its own."""
+    frame = int(VAD_FRAME_SECONDS * sr)
+    limit = int(max_seconds * sr)
+    pieces: List[Tuple[int, int]] = []
+    for start, end in regions:
+        while end - start > limit:
+            lo = start + limit * 3 // 4
+            window = audio[lo:start + limit]
+            n = len(window) // frame
+            energy = (window[:n * frame].reshape(n, frame) ** 2).mean(axis=1)
+            cut = lo + int(np.argmin(energy)) * frame + frame // 2
+            pieces.append((start, cut))
+            start = cut
+        pieces.append((start, end))
+    return pieces
+
+
+def _segment(seg: Dict[str, Any], offset: float, word_timestamps: bool) -> Dict[str, Any]:
+    out = {
+        "start": offset + float(seg.get("start", 0.0)),
+        "end": offset + float(seg.get("end", 0.0)),
+        "text": seg.get("text", "").strip(),
+    }
+    if word_timestamps:
+        out["words"] = [
+            {
+                "word": w.get("word", "").strip(),
+                "start": offset + float(w.get("start", 0.0)),
+                "end": offset + float(w.get("end", 0.0)),
+            }
+            for w in seg.get("words", [])
+        ]
+    return out
+
+
+def _decode(audio_path: str, model_name: str, language: str,
+            word_timestamps: bool) -> Iterator[Dict[str, Any]]:
+    audio = whisper.load_audio(audio_path)
+    regions = speech_regions(audio) if WHISPER_VAD else [(0, len(audio))]
+    options: Dict[str, Any] = {"language": language}
+    if word_timestamps:
+        options["word_timestamps"] = True
+
+    prompt = None
+    # held until the last piece is decoded, so the idle reaper leaves it alone
+    with whisper_pool.checkout(model_name) as model:
+        for start, end in split_long(audio, regions):
+            result = model.transcribe(audio[start:end], initial_prompt=prompt, **options)
+            for seg in result.get("segments", []):
+                yield _segment(seg, start / SAMPLE_RATE, word_timestamps)
+            # keep the context Whisper would have had without the cut
+            prompt = (result.get("text") or "").strip()[-200:] or prompt
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Background transcription of the audio of queued jobs.
+
+When several jobs are queued at once (an album upload), their tracks are
+transcribed back-to-back in this process's Whisper session, grouped by
+model, while the jobs still wait for a worker. Results go to the shared
+analysis cache, where each job's own transcribe stage picks them up and
+writes its segments file.
+"""
+
+import os
+import threading
+import traceback
+from typing import Callable, Dict, List, Tuple
+
+import transcribe
+from scheduler import stage_slot
+
+WHISPER_BATCH = os.environ.get("WHISPER_BATCH", "1") != "0"
+WHISPER_BATCH_SIZE = int(os.environ.get("WHISPER_BATCH_SIZE", "16"))
+BATCH_POLL_SECONDS = 30.0
+
+
+class TranscriptionBatcher:
+    def __init__(self, pending: Callable[[int], List[Tuple[str, str, str, bool]]],
+                 batch_size: int = WHISPER_BATCH_SIZE):
+        """`pending(limit)` returns (audio_path, model_name, language,
+        word_timestamps) of queued jobs, in the order the queue will run
+        them; the job's transcribe stage looks the track up with the same."""
+        self.pending = pending
+        self.batch_size = batch_size
+        self.transcribed = 0
+        self.batches = 0
+        self.errors = 0
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def notify(self):
+        self._event.set()
+
+    def run_batch(self) -> int:
+        items = []
+        for item in self.pending(self.batch_size):
+            if item in items or not os.path.exists(item[0]):
+                continue
+            if not transcribe.is_cached(*item):
+                items.append(item)
+        if not items:
+            return 0
+
+        # one model at a time, so the session is not swapped back and forth
+        order = {}
+        for item in items:
+            order.setdefault(item[1], len(order))
+        items.sort(key=lambda item: order[item[1]])
+
+        done = 0
+        for item in items:
+            try:
+                with stage_slot("whisper"):
+                    transcribe.transcribe_cached(*item)
+                done += 1
+            except Exception:
+                traceback.print_exc()
+                with self._lock:
+                    self.errors += 1
+        with self._lock:
+            self.transcribed += done
+            self.batches += 1
+        return done
+
+    def _loop(self):
+        while True:
+            self._event.wait(BATCH_POLL_SECONDS)
+            self._event.clear()
+            try:
+                self.run_batch()
+            except Exception:
+                traceback.print_exc()
+
+    def start(self):
+        if self._thread is not None or not WHISPER_BATCH or transcribe.whisper is None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="whisper-batch", daemon=True)
+        self._thread.start()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": self._thread is not None,
+                "batches": self.batches,
+                "transcribed": self.transcribed,
+                "errors": self.errors,
+            }
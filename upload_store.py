@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Content-addressed store for uploaded audio/video.
+
+An upload is written once, in chunks, into a spool file of the store while
+its sha256 is computed, then moved to <root>/<sha[:2]>/<sha>. A job gets
+its own name for the file as a hardlink to that blob, so the same
+background video uploaded for fifty jobs takes the disk space of one and
+the link count of a blob is its reference count. If hardlinks are not
+possible (another filesystem) the job gets a copy instead.
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from typing import Any, Dict, Tuple
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+UPLOAD_STORE_DIR = os.environ.get(
+    "UPLOAD_STORE_DIR", os.path.join(BASE_DIR, "uploads", "blobs")
+)
+
+_CHUNK = 1024 * 1024
+
+
+def _default_file_mode() -> int:
+    # what open() would have given the upload (0666 minus the umask); mkstemp
+    # creates 0600, and every hardlink of a blob shares its mode
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+FILE_MODE = _default_file_mode()
+_STALE_SPOOL_SECONDS = 24 * 3600
+
+
+class HashingSpool:
+    """Writable temp file in the store that hashes what is written to it.
+
+    Used as werkzeug's stream for file parts, so the request body is hashed
+    while it is parsed and never copied from a second temp file. A spool
+    that is not committed removes its file when it is garbage collected."""
+
+    def __init__(self, folder: str):
+        os.makedirs(folder, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(prefix=".tmp_", dir=folder)
+        self._file = os.fdopen(fd, "w+b")
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.committed = False
+
+    def write(self, data: bytes) -> int:
+        self._hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._file, name)
+
+    def discard(self):
+        self._file.close()
+        if not self.committed and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __del__(self):
+        if "_file" not in self.__dict__:
+            return
+        try:
+            self.discard()
+        except Exception:
+            pass
+
+
+class UploadStore:
+    def __init__(self, root: str):
+        self.root = root
+        self.uploads = 0
+        self.deduplicated = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def spool(self) -> HashingSpool:
+        return HashingSpool(self.root)
+
+    def save(self, file_obj, dest_path: str) -> Tuple[str, str]:
+        """Store a werkzeug FileStorage and link it at dest_path; returns
+        (dest_path, sha256)."""
+        spool = file_obj.stream
+        if not isinstance(spool, HashingSpool):
+            spool = self.spool()
+            for chunk in iter(lambda: file_obj.stream.read(_CHUNK), b""):
+                spool.write(chunk)
+        spool.flush()
+        digest = spool.hexdigest()
+        blob = self.blob_path(digest)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+
+        # two uploads of the same new file must not both install a blob
+        with self._lock:
+            duplicate = os.path.exists(blob)
+            if duplicate:
+                spool.discard()
+                # blobs stored before FILE_MODE was applied
+                os.chmod(blob, FILE_MODE)
+            else:
+                spool.close()
+                os.chmod(spool.path, FILE_MODE)
+                os.replace(spool.path, blob)
+                spool.committed = True
+
+            if os.path.exists(dest_path):
+                os.remove(dest_path)
+            try:
+                os.link(blob, dest_path)
+            except OSError:
+                shutil.copyfile(blob, dest_path)
+
+            self.uploads += 1
+            if duplicate:
+                self.deduplicated += 1
+                self.bytes_saved += spool.size
+        return dest_path, digest
+
+    def release(self, path: str, digest: str):
+        """Drop a job's link; the blob goes with its last reference."""
+        blob = self.blob_path(digest)
+        with self._lock:
+            if os.path.exists(path):
+                os.remove(path)
+            try:
+                if os.stat(blob).st_nlink <= 1:
+                    os.remove(blob)
+            except FileNotFoundError:
+                pass
+
+    def sweep_spools(self, max_age: float = _STALE_SPOOL_SECONDS) -> int:
+        """Remove spool files left behind by interrupted uploads."""
+        removed = 0
+        if not os.path.isdir(self.root):
+            return removed
+        cutoff = time.time() - max_age
+        for fn in os.listdir(self.root):
+            path = os.path.join(self.root, fn)
+            if fn.startswith(".tmp_") and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        blobs = 0
+        stored = 0
+        referenced = 0
+        if os.path.isdir(self.root):
+            for root, _, files in os.walk(self.root):
+                for fn in files:
+                    if fn.startswith(".tmp_"):
+                        continue
+                    try:
+                        st = os.stat(os.path.join(root, fn))
+                    except OSError:
+                        continue
+                    blobs += 1
+                    stored += st.st_size
+                    referenced += st.st_size * max(0, st.st_nlink - 1)
+        with self._lock:
+            return {
+                "blobs": blobs,
+                "bytes": stored,
+                "referenced_bytes": referenced,
+                "uploads": self.uploads,
+                "deduplicated": self.deduplicated,
+                "bytes_saved": self.bytes_saved,
+            }
+
+
+UPLOAD_STORE = UploadStore(UPLOAD_STORE_DIR)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Process-wide registry of loaded Whisper models.
+
+Models are loaded once per worker process and reused by every job; models
+that have not been used for WHISPER_IDLE_SECONDS are dropped to free RAM.
+A transcription holds its model through checkout(), and a model that is
+checked out is never dropped, however long the transcription takes.
+"""
+
+import os
+import gc
+import time
+import threading
+import contextlib
+from typing import Dict, Iterable, Iterator, List
+
+try:
+    import whisper
+except Exception:
+    whisper = None
+
+WHISPER_MODELS = ("tiny", "base", "small", "medium", "large")
+DEFAULT_WHISPER_MODEL = os.environ.get("WHISPER_DEFAULT_MODEL", "small")
+WHISPER_IDLE_SECONDS = float(os.environ.get("WHISPER_IDLE_SECONDS", "1800"))
+
+_models: Dict[str, object] = {}
+_last_used: Dict[str, float] = {}
+_in_use: Dict[str, int] = {}
+_load_locks: Dict[str, threading.Lock] = {}
+_lock = threading.Lock()
+_reaper: threading.Thread | None = None
+
+
+def resolve_model_name(*candidates: str | None) -> str:
+    for name in candidates:
+        if name and name in WHISPER_MODELS:
+            return name
+    return DEFAULT_WHISPER_MODEL
+
+
+def get_model(model_name: str):
+    if whisper is None:
+        raise RuntimeError("whisper نصب نشده است.")
+
+    with _lock:
+        model = _models.get(model_name)
+        if model is not None:
+            _last_used[model_name] = time.monotonic()
+            return model
+        load_lock = _load_locks.setdefault(model_name, threading.Lock())
+
+    # Only one thread loads a given model; the others wait and reuse it.
+    with load_lock:
+        with _lock:
+            model = _models.get(model_name)
+        if model is None:
+            model = whisper.load_model(model_name)
+            with _lock:
+                _models[model_name] = model
+        with _lock:
+            _last_used[model_name] = time.monotonic()
+        return model
+
+
+@contextlib.contextmanager
+def checkout(model_name: str) -> Iterator[object]:
+    """The model, kept loaded until the block exits."""
+    with _lock:
+        _in_use[model_name] = _in_use.get(model_name, 0) + 1
+    try:
+        yield get_model(model_name)
+    finally:
+        with _lock:
+            _in_use[model_name] -= 1
+            if not _in_use[model_name]:
+                del _in_use[model_name]
+            _last_used[model_name] = time.monotonic()
+
+
+def preload(model_names: Iterable[str]):
+    for name in model_names:
+        name = name.strip()
+        if name:
+            get_model(name)
+
+
+def evict_idle(max_idle_seconds: float = WHISPER_IDLE_SECONDS) -> List[str]:
+    now = time.monotonic()
+    evicted = []
+    with _lock:
+        for name, last in list(_last_used.items()):
+            if name in _in_use:
+                continue
+            if now - last >= max_idle_seconds:
+                _models.pop(name, None)
+                _last_used.pop(name, None)
+                evicted.append(name)
+    if evicted:
+        gc.collect()
+    return evicted
+
+
+def loaded_models() -> Dict[str, float]:
+    now = time.monotonic()
+    with _lock:
+        return {name: now - last for name, last in _last_used.items()}
+
+
+def _reaper_loop(interval: float):
+    while True:
+        time.sleep(interval)
+        evict_idle()
+
+
+def start_idle_reaper(interval: float = 60.0):
+    global _reaper
+    if _reaper is not None or WHISPER_IDLE_SECONDS <= 0:
+        return
+    _reaper = threading.Thread(target=_reaper_loop, args=(interval,), daemon=True)
+    _reaper.start()